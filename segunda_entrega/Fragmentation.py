@@ -1,57 +1,143 @@
 import math
-import uuid
-import zlib
+import mmap
+import os
 
+import codec
+import config
 
-def Fragmentation(txt_archive_path):
+
+class Fragmenter:
     """
-    Fragmenta o conteúdo de um arquivo texto em múltiplos pacotes UDP, cada um com cabeçalho próprio.
+    Fragmentador reutilizável que divide uma mensagem (str ou bytes) em múltiplos pacotes UDP,
+    cada um com cabeçalho próprio, sem passar por arquivos temporários.
     O cabeçalho contém:
       - checksum: verificação de integridade do pacote
-      - ID da mensagem (UUID): identifica o conjunto de pacotes de uma mesma mensagem
+      - ID da mensagem: identifica o conjunto de pacotes de uma mesma mensagem
       - número do pacote: ordem do fragmento
       - total de pacotes: quantos fragmentos compõem a mensagem
       - flag de fim: 1 se for o último pacote, 0 caso contrário
-    O formato do cabeçalho é:
-      <CHECKSUM>|<ID>|<SEQ>|<TOTAL>|<FLAG>|<DADOS>
+    Por padrão usa o cabeçalho binário de codec.py; com version=codec.LEGACY_VERSION gera o
+    formato em texto <CHECKSUM>|<ID>|<SEQ>|<TOTAL>|<FLAG>|<DADOS>.
+    O payload de cada fragmento é o tamanho do datagrama menos o tamanho real do cabeçalho,
+    de modo que cada pacote ocupa exatamente o datagrama configurado.
+    Com compress=True, mensagens maiores que compression_threshold bytes (por padrão, as que
+    ocupariam mais de um fragmento) são comprimidas com zlib antes da fragmentação, e todos os
+    fragmentos levam codec.FLAG_COMPRESSED; se a compressão não reduzir o tamanho, a mensagem
+    segue sem compressão. O formato legado não suporta compressão.
+    flags são acrescentadas às flags de todos os fragmentos (por exemplo, codec.FLAG_BATCH).
+    """
+
+    def __init__(self, buffer_size=None, version=codec.PROTOCOL_VERSION, compression_threshold=None):
+        if buffer_size is None:
+            buffer_size = config.LEGACY_DATAGRAM_SIZE if version == codec.LEGACY_VERSION else config.DATAGRAM_SIZE
+        self.version = version
+        self.buffer_size = buffer_size
+        self.payload_size = buffer_size - codec.header_size(version)
+        if self.payload_size <= 0:
+            raise ValueError(f"datagrama de {buffer_size} bytes não comporta o cabeçalho")
+        self.compression_threshold = self.payload_size if compression_threshold is None else compression_threshold
+
+    def fragment(self, message, msg_id=None, compress=False, flags=0):
+        # Converte o conteúdo para bytes, se necessário
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+
+        # Comprime mensagens grandes, se o destinatário aceitar
+        message_flags = flags
+        if compress and self.version != codec.LEGACY_VERSION and len(message) > self.compression_threshold:
+            message, compression_flags = codec.compress(message)
+            message_flags |= compression_flags
+        content_size = len(message)
+
+        # Se a mensagem estiver vazia, retorna lista vazia
+        if content_size == 0:
+            return []
+
+        # Calcula o número total de pacotes necessários
+        total_packets = math.ceil(content_size / self.payload_size)
+        # Gera um ID para identificar a mensagem, se não foi informado
+        if msg_id is None:
+            msg_id = codec.new_message_id(self.version)
+
+        # Fragmenta o conteúdo em pacotes
+        packets_to_send = []
+        for packet_Num, i in enumerate(range(0, content_size, self.payload_size)):
+            chunk = message[i:i + self.payload_size]
+            # Flag de fim no último pacote
+            flags = message_flags | (codec.FLAG_END if packet_Num == total_packets - 1 else 0)
+            packets_to_send.append(
+                codec.encode_data(msg_id, packet_Num, total_packets, chunk, flags, self.version))
+        return packets_to_send
+
+    # Fragmentação preguiçosa de bytes, memoryview ou mmap: os pacotes são montados sob
+    # demanda, sem copiar o conteúdo nem montar a lista completa
+    def lazy(self, content, msg_id=None):
+        if msg_id is None:
+            msg_id = codec.new_message_id(self.version)
+        return LazyFragments(content, msg_id, self.payload_size, self.version)
+
+    # Fragmenta um arquivo (texto ou binário) mapeado em memória com mmap. O total de pacotes
+    # vem do tamanho do arquivo, e cada pacote é montado apenas quando é enviado, de modo
+    # que o uso de memória não depende do tamanho do arquivo. Use close() (ou with) ao final.
+    def fragment_file(self, path, msg_id=None):
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return self.lazy(b"", msg_id)
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        fragments = self.lazy(mapped, msg_id)
+        fragments.mapped = mapped
+        return fragments
+
+
+class LazyFragments:
+    """
+    Sequência preguiçosa dos pacotes de uma mensagem, sobre um memoryview do conteúdo.
+    len() e o total de pacotes vêm do tamanho do conteúdo; fragments[seq] monta o pacote seq
+    (fatia do memoryview + cabeçalho) no momento do envio, e a iteração é um gerador que
+    produz um pacote por vez. Serve diretamente como lista de pacotes do SelectiveRepeatSender:
+    só os pacotes da janela existem em memória, e uma retransmissão remonta o pacote.
+    """
+
+    def __init__(self, content, msg_id, payload_size, version=codec.PROTOCOL_VERSION):
+        self.view = memoryview(content).cast('B')
+        self.msg_id = msg_id
+        self.payload_size = payload_size
+        self.version = version
+        self.total = math.ceil(len(self.view) / payload_size)
+        # mmap do arquivo, fechado junto com a sequência (ver Fragmenter.fragment_file)
+        self.mapped = None
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, seq):
+        if not 0 <= seq < self.total:
+            raise IndexError(seq)
+        chunk = self.view[seq * self.payload_size:(seq + 1) * self.payload_size]
+        flags = codec.FLAG_END if seq == self.total - 1 else 0
+        return codec.encode_data(self.msg_id, seq, self.total, chunk, flags, self.version)
+
+    def __iter__(self):
+        for seq in range(self.total):
+            yield self[seq]
+
+    def close(self):
+        self.view.release()
+        if self.mapped is not None:
+            self.mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def Fragmentation(txt_archive_path):
+    """
+    Fragmenta o conteúdo de um arquivo em múltiplos pacotes UDP.
+    Mantida por compatibilidade: retorna a lista completa de pacotes, montada a partir do
+    arquivo mapeado em memória (sem decodificar e recodificar o texto).
     """
-    # Tamanho máximo do pacote UDP
-    BUFFER_SIZE = 1024
-    # Reserva espaço para o cabeçalho (estimado em 128 bytes)
-    payload_size = BUFFER_SIZE - 128
-
-    # Lê o conteúdo do arquivo texto
-    with open(txt_archive_path, 'r', encoding='utf-8') as file:
-        file_content = file.read()
-
-    # Converte o conteúdo para bytes
-    file_content_bytes = file_content.encode('utf-8')
-    file_size = len(file_content_bytes)
-
-    # Se o arquivo estiver vazio, retorna lista vazia
-    if file_size == 0:
-        return []
-
-    # Calcula o número total de pacotes necessários
-    total_packets = math.ceil(file_size / payload_size)
-    packets_to_send = []
-    packet_Num = 0
-    # Gera um UUID para identificar a mensagem
-    arquive_id = str(uuid.uuid4())
-
-    # Fragmenta o conteúdo em pacotes
-    for i in range(0, file_size, payload_size):
-        chunk = file_content_bytes[i:i + payload_size]
-        # Flag de fim: 1 se for o último pacote, 0 caso contrário
-        flag_end = 1 if packet_Num == total_packets - 1 else 0
-        # Monta o cabeçalho sem o checksum
-        header_str = f"{arquive_id}|{packet_Num}|{total_packets}|{flag_end}|"
-        header_bytes = header_str.encode('utf-8')
-        # Calcula o checksum sobre cabeçalho + chunk
-        checksum = zlib.crc32(header_bytes + chunk)
-        # Cabeçalho final: checksum + cabeçalho + chunk
-        full_header_str = f"{checksum}|{header_str}"
-        final_packet = full_header_str.encode('utf-8') + chunk
-        packets_to_send.append(final_packet)
-        packet_Num += 1
-    return packets_to_send
+    with Fragmenter().fragment_file(txt_archive_path) as fragments:
+        return list(fragments)
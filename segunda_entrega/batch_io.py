@@ -0,0 +1,87 @@
+import socket
+import struct
+import sys
+
+# Opções de socket do Linux para UDP GSO/GRO (linux/udp.h); nem todas as versões do Python
+# expõem as constantes
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)
+UDP_GRO = getattr(socket, "UDP_GRO", 104)
+
+# Limites do kernel para um envio GSO: no máximo 64 segmentos e um datagrama UDP de até 64 KiB
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65507
+# Buffer de recepção com GRO: um datagrama agregado pode ter até 64 KiB
+GRO_BUFFER_SIZE = 65535
+
+
+class BatchSocket:
+    """
+    Envio e recepção em lote sobre um socket UDP no Linux.
+    - Envio (GSO, UDP_SEGMENT): uma sequência de fragmentos do mesmo tamanho (o último pode
+      ser menor) é passada ao kernel em um único sendmsg, que a divide em datagramas.
+    - Recepção (GRO, UDP_GRO): o kernel agrega datagramas do mesmo fluxo e tamanho, que são
+      lidos com um único recvmsg e separados de volta pelo tamanho de segmento informado.
+    Se o kernel ou a plataforma não suportarem algum dos dois, o objeto recai sobre sendto e
+    recvfrom comuns, um datagrama por chamada.
+    """
+
+    def __init__(self, sock, buffer_size):
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.gso = sys.platform.startswith("linux") and hasattr(sock, "sendmsg")
+        self.gro = False
+        if sys.platform.startswith("linux") and hasattr(sock, "recvmsg"):
+            try:
+                sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+                self.gro = True
+            except OSError:
+                pass
+
+    # Envia vários pacotes para o mesmo destino com o menor número de chamadas possível
+    def send_batch(self, packets, address):
+        start = 0
+        while start < len(packets):
+            end = self._gso_run(packets, start)
+            if self.gso and end - start > 1:
+                try:
+                    segment = len(packets[start])
+                    self.sock.sendmsg([b"".join(packets[start:end])],
+                                      [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", segment))], 0, address)
+                    start = end
+                    continue
+                except OSError:
+                    # Kernel sem suporte a UDP_SEGMENT: desativa e envia um a um
+                    self.gso = False
+            self.sock.sendto(packets[start], address)
+            start += 1
+
+    # Fim (exclusivo) da maior sequência a partir de start que pode ir em um único envio GSO
+    def _gso_run(self, packets, start):
+        segment = len(packets[start])
+        total = segment
+        end = start + 1
+        while end < len(packets) and end - start < GSO_MAX_SEGMENTS:
+            size = len(packets[end])
+            if size > segment or total + size > GSO_MAX_BYTES:
+                break
+            total += size
+            end += 1
+            if size < segment:
+                break
+        return end
+
+    # Recebe um ou mais datagramas do mesmo remetente. Retorna (lista de datagramas, endereço).
+    def recv_batch(self):
+        if not self.gro:
+            data, address = self.sock.recvfrom(self.buffer_size)
+            return [data], address
+        data, ancdata, _, address = self.sock.recvmsg(GRO_BUFFER_SIZE, socket.CMSG_SPACE(4))
+        segment = 0
+        for level, kind, value in ancdata:
+            if level == SOL_UDP and kind == UDP_GRO:
+                segment = int.from_bytes(value[:4], sys.byteorder)
+        if not segment or segment >= len(data):
+            return [data], address
+        view = memoryview(data)
+        return [view[i:i + segment] for i in range(0, len(data), segment)], address
@@ -0,0 +1,84 @@
+import argparse
+import socket
+import threading
+import time
+
+import client
+import codec
+import config
+import rdt
+import timers
+from Fragmentation import Fragmenter
+
+# Benchmark em loopback do envio confiável: para cada tamanho de datagrama, envia mensagens
+# com o remetente Selective Repeat do cliente para um receptor mínimo (que confirma e monta
+# as mensagens) e mede mensagens/s e goodput (bytes úteis entregues por segundo).
+#
+#   python bench.py --sizes 512 1024 1472 8972 65507 --messages 200 --message-size 65536
+
+DEFAULT_SIZES = [512, 1024, 1472, 4096, 8972, 16384, 65507]
+
+
+# Receptor mínimo: confirma os fragmentos com SACK e conta as mensagens completas
+def run_sink(sink_socket, buffer_size, counter, stop):
+    scheduler = timers.TimerWheel()
+    receiver = rdt.SackReceiver(scheduler)
+    while not stop.is_set():
+        timeout = scheduler.next_timeout()
+        sink_socket.settimeout(0.2 if timeout is None else max(timeout, 0.001))
+        try:
+            data, sender_addr = sink_socket.recvfrom(buffer_size)
+            packet = codec.decode(data)
+            if packet.kind == codec.QUERY:
+                receiver.answer_query(sink_socket, sender_addr, packet.msg_id, buffer_size)
+            elif receiver.receive(packet, sender_addr, sink_socket) is not None:
+                counter[0] += 1
+        except (socket.timeout, codec.PacketError):
+            pass
+        scheduler.advance()
+
+
+# Mede o envio de `messages` mensagens de `message_size` bytes com datagramas de `datagram_size` bytes
+def run(datagram_size, messages, message_size, window_size):
+    sink_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink_socket.bind(("127.0.0.1", 0))
+    counter = [0]
+    stop = threading.Event()
+    sink = threading.Thread(target=run_sink, args=(sink_socket, datagram_size, counter, stop), daemon=True)
+    sink.start()
+
+    sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender_socket.bind(("127.0.0.1", 0))
+    threading.Thread(target=client.receive_message, args=(sender_socket,), daemon=True).start()
+
+    fragmenter = Fragmenter(datagram_size)
+    payload = b"x" * message_size
+    fragments_per_message = len(fragmenter.fragment(payload))
+    start = time.perf_counter()
+    for _ in range(messages):
+        arquivo_id = codec.new_message_id()
+        client.send_fragments(sender_socket, arquivo_id, fragmenter.fragment(payload, arquivo_id),
+                              window_size, sink_socket.getsockname())
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    sink.join()
+    sink_socket.close()
+    return fragments_per_message, counter[0] / elapsed, counter[0] * message_size / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark em loopback por tamanho de datagrama")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="tamanhos de datagrama a medir, em bytes")
+    parser.add_argument("--messages", type=int, default=200, help="mensagens por tamanho")
+    parser.add_argument("--message-size", type=int, default=64 * 1024, help="tamanho de cada mensagem, em bytes")
+    parser.add_argument("--window", type=int, default=rdt.WINDOW_SIZE, help="janela Selective Repeat")
+    args = parser.parse_args()
+
+    print(f"{'datagrama':>10} {'payload':>8} {'frags/msg':>10} {'msgs/s':>10} {'goodput MB/s':>13}")
+    for size in args.sizes:
+        if size > config.MAX_DATAGRAM_SIZE:
+            continue
+        fragments, rate, goodput = run(size, args.messages, args.message_size, args.window)
+        print(f"{size:>10} {size - codec.HEADER_SIZE:>8} {fragments:>10} {rate:>10.1f} {goodput / 1e6:>13.2f}")
@@ -0,0 +1,113 @@
+import argparse
+import contextlib
+import io
+import itertools
+import math
+import socket
+import threading
+import time
+
+import bench
+import client
+import codec
+import config
+import rdt
+from Fragmentation import Fragmenter
+from netem import LossyProxy
+
+# Benchmark do envio confiável sob perdas: para cada combinação de perdas (grade de
+# parâmetros do netem.LossyProxy), envia mensagens com o remetente Selective Repeat do cliente
+# através do proxy até o receptor mínimo de bench.py e mede o goodput, as retransmissões e a
+# latência de cada mensagem (do primeiro envio à confirmação do último fragmento), p50 e p99,
+# além da janela de congestionamento do remetente ao final.
+#
+#   python bench_netem.py --loss 0 0.01 0.05 --corrupt 0 0.01 --reorder 0 0.05 --messages 50
+
+
+# Percentil p (0 a 100) de uma lista de valores, pelo método do posto mais próximo
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+# Mede o envio de `messages` mensagens de `message_size` bytes através de um proxy com as
+# perdas informadas. Retorna um dicionário com os resultados.
+def run(impairments, messages, message_size, window_size, seed):
+    sink_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink_socket.bind(("127.0.0.1", 0))
+    counter = [0]
+    stop = threading.Event()
+    sink = threading.Thread(target=bench.run_sink, args=(sink_socket, config.DATAGRAM_SIZE, counter, stop), daemon=True)
+    sink.start()
+
+    proxy = LossyProxy(("127.0.0.1", 0), sink_socket.getsockname(), seed=seed, **impairments)
+    proxy_thread = threading.Thread(target=proxy.serve, args=(stop,), daemon=True)
+    proxy_thread.start()
+
+    sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender_socket.bind(("127.0.0.1", 0))
+    threading.Thread(target=client.receive_message, args=(sender_socket,), daemon=True).start()
+
+    fragmenter = Fragmenter()
+    payload = b"x" * message_size
+    latencies = []
+    failed = 0
+    start = time.perf_counter()
+    # As mensagens de timeout do cliente não interessam ao relatório
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(messages):
+            arquivo_id = codec.new_message_id()
+            sent_at = time.perf_counter()
+            try:
+                client.send_fragments(sender_socket, arquivo_id, fragmenter.fragment(payload, arquivo_id),
+                                      window_size, proxy.address())
+                latencies.append(time.perf_counter() - sent_at)
+            except TimeoutError:
+                failed += 1
+    elapsed = time.perf_counter() - start
+    cwnd = client.peers[proxy.address()].congestion.cwnd
+
+    stop.set()
+    sink.join()
+    proxy_thread.join()
+    proxy.close()
+    sink_socket.close()
+    return {
+        "goodput": len(latencies) * message_size / elapsed,
+        "retransmissions": proxy.stats["retransmissions"],
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "failed": failed,
+        "cwnd": cwnd,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do envio confiável sob perdas emuladas")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.01, 0.05, 0.1],
+                        help="probabilidades de descarte a medir")
+    parser.add_argument("--corrupt", type=float, nargs="+", default=[0.0, 0.02],
+                        help="probabilidades de corrupção a medir")
+    parser.add_argument("--duplicate", type=float, nargs="+", default=[0.0],
+                        help="probabilidades de duplicação a medir")
+    parser.add_argument("--reorder", type=float, nargs="+", default=[0.0, 0.05],
+                        help="probabilidades de reordenação a medir")
+    parser.add_argument("--delay", type=float, nargs="+", default=[0.002],
+                        help="atrasos a medir, em segundos")
+    parser.add_argument("--messages", type=int, default=50, help="mensagens por combinação")
+    parser.add_argument("--message-size", type=int, default=16 * 1024, help="tamanho de cada mensagem, em bytes")
+    parser.add_argument("--window", type=int, default=rdt.WINDOW_SIZE, help="janela Selective Repeat")
+    parser.add_argument("--seed", type=int, default=0, help="semente dos sorteios do proxy")
+    args = parser.parse_args()
+
+    print(f"{'perda':>6} {'corrup':>6} {'dupl':>6} {'reord':>6} {'atraso':>7} "
+          f"{'goodput KB/s':>13} {'retrans':>8} {'p50 ms':>8} {'p99 ms':>8} {'falhas':>6} {'cwnd':>7}")
+    for loss, corrupt, duplicate, reorder, delay in itertools.product(
+            args.loss, args.corrupt, args.duplicate, args.reorder, args.delay):
+        impairments = {"loss": loss, "corrupt": corrupt, "duplicate": duplicate, "reorder": reorder, "delay": delay}
+        result = run(impairments, args.messages, args.message_size, args.window, args.seed)
+        print(f"{loss:>6.3f} {corrupt:>6.3f} {duplicate:>6.3f} {reorder:>6.3f} {delay * 1000:>5.1f}ms "
+              f"{result['goodput'] / 1e3:>13.1f} {result['retransmissions']:>8} "
+              f"{result['p50'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} {result['failed']:>6} {result['cwnd']:>7.1f}")
@@ -1,200 +1,290 @@
+import argparse
+import os
+import queue
+import select
 import socket
 import threading
-import os
-from datetime import datetime
-from Fragmentation import Fragmentation
-import zlib
-import time
+from functools import partial
+from Fragmentation import Fragmenter
+from batch_io import BatchSocket
+import codec
+import config
+import metrics
+import rdt
+import timers
+import transfer
 
 # Configurações do cliente
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 12345
-BUFFER_SIZE = 1024
-
-# Variáveis para controle de ACKs recebidos
-received_acks = {}
-acks_lock = threading.Lock()
-
-# Função utilitária para salvar mensagens em arquivo temporário (usado para fragmentação)
-def write_message(message):
-    path_name = f"user_{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.txt"
-    with open(path_name, "w", encoding="utf-8") as file:
-        file.write(message)
-    return path_name
-
-# Função que recebe mensagens do servidor e implementa o RDT 3.0 para recebimento
-def receive_message(client_socket):
-    last_ack_sent = {}
+# Buffer de recepção: o mesmo tamanho de datagrama usado pelo remetente
+BUFFER_SIZE = config.DATAGRAM_SIZE
+# Comando do cliente para enviar um arquivo: /enviar <caminho>
+SEND_FILE_COMMAND = "/enviar "
+# Comando de consulta das métricas: exibe as do cliente e é repassado ao servidor, que
+# responde com as suas
+STATS_COMMAND = "/stats"
+# Tentativas de consulta dos fragmentos que o servidor já tem de uma transferência
+QUERY_ATTEMPTS = 3
+
+# Registro dos ACKs recebidos: a thread de recepção acorda diretamente o envio
+received_acks = rdt.AckRegistry()
+# Pares que aceitam mensagens comprimidas (anunciado nos SACKs): {endereço}
+compression_peers = set()
+# Envio confiável por par (servidor ou proxy): {endereço: rdt.PeerSender}, com o estimador
+# de RTT e a janela de congestionamento de cada um
+peers = {}
+# Temporizadores de retransmissão do envio (usados apenas pela thread de envio)
+scheduler = timers.TimerWheel()
+# Entregas abandonadas pelos temporizadores, ainda não informadas ao laço de envio: {ID: motivo}
+send_failures = {}
+
+# Estado da recepção (usado apenas pela thread de recepção): temporizadores dos ACKs
+# atrasados e montagem das mensagens, confirmadas com SACK
+receive_scheduler = timers.TimerWheel()
+# Métricas de execução do cliente (contadores, janela de congestionamento e histogramas de
+# RTT e latência), exibidas com o comando /stats
+stats = metrics.Metrics()
+# Mensagens recebidas aguardando exibição (thread de exibição) e bytes ainda não exibidos, que
+# ocupam a janela de recepção anunciada ao servidor: um terminal lento fecha a janela em vez
+# de acumular mensagens sem limite
+deliveries = queue.SimpleQueue()
+display_lock = threading.Lock()
+display_backlog = 0
+receiver = rdt.SackReceiver(receive_scheduler, stats=stats, backlog=lambda: display_backlog,
+                            ack_flags=codec.FLAG_ACCEPTS_COMPRESSED | codec.FLAG_ACCEPTS_BATCH)
+# Envio e recepção em lote (GSO/GRO), ativados com --batch-io
+batch_socket = None
+
+# Fragmentador reutilizado por todos os envios (sem arquivos temporários)
+fragmenter = Fragmenter()
+
+# Processa um datagrama recebido: implementa o RDT 3.0 do lado do receptor.
+# Os fragmentos são guardados fora de ordem (Selective Repeat) e confirmados com SACK
+# até que a mensagem esteja completa.
+def handle_datagram(data, sender_addr, client_socket):
+    stats.increment("packets_in")
+    stats.increment("bytes_in", len(data))
+    try:
+        packet = codec.decode(data)
+    except codec.ChecksumError:
+        #print('[ERRO] Pacote corrompido (checksum inválido).')
+        stats.increment("checksum_errors")
+        return
+    except codec.PacketError:
+        #print('[ERRO] Pacote mal formatado.')
+        stats.increment("malformed_packets")
+        return
+
+    if packet.kind in (codec.ACK, codec.SACK):
+        stats.increment("acks_in")
+        if packet.flags & codec.FLAG_ACCEPTS_COMPRESSED:
+            compression_peers.add(sender_addr)
+        cumulative, seqs = codec.ack_info(packet)
+        received_acks.notify(packet.msg_id, cumulative, seqs, codec.advertised_window(packet))
+        return
+    # Sonda de janela zero do servidor: responde com o SACK e a janela atual
+    if packet.kind == codec.QUERY:
+        receiver.answer_query(client_socket, sender_addr, packet.msg_id, config.DATAGRAM_SIZE)
+        return
+
+    #print('[OK] Checksum válido!')
+    assembled = receiver.receive(packet, sender_addr, client_socket)
+    if assembled is None:
+        #print('[PROCESSO] Aguardando próximo fragmento para montagem da mensagem completa...')
+        return
+    # Lote de mensagens curtas agrupadas pelo servidor: cada uma é exibida separadamente
+    if packet.flags & codec.FLAG_BATCH:
+        for message in codec.split_batch(assembled):
+            deliver(message)
+        return
+    deliver(assembled)
+
+# Entrega uma mensagem montada à thread de exibição
+def deliver(message):
+    global display_backlog
+    with display_lock:
+        display_backlog += len(message)
+    deliveries.put(message)
+
+# Thread de exibição: imprime as mensagens recebidas e libera o espaço que ocupavam na janela
+# de recepção
+def display_messages():
+    global display_backlog
     while True:
-        try:
-            data, sender_addr = client_socket.recvfrom(BUFFER_SIZE)
-            data_str = data.decode(errors='ignore')
-
-            if data_str.startswith('ACK|'):
-                with acks_lock:
-                    ack_parts = data_str.split('|')
-                    if len(ack_parts) != 4:
-                        continue
-                    
-                    _, arquivo_id, num_pacote, received_ack_checksum = ack_parts
-
-                    ack_base = f"ACK|{arquivo_id}|{num_pacote}"
-                    ack_checksum = zlib.crc32(ack_base.encode('utf-8'))
-
-                    if str(ack_checksum) == received_ack_checksum:
-                        received_acks[(arquivo_id, num_pacote)] = True
-                    else:
-                        print("[AVISO] Checksum de ACK inválido. Pacote ignorado.")
-                continue
-
-            #print(f"[RECEBIDO] Pacote recebido de {sender_addr} ({len(data)} bytes)")
-            split_idx = data_str.find('|')
-            if split_idx == -1:
-                #print('[ERRO] Pacote de dados mal formatado (sem checksum).')
-                continue
-            
-            received_checksum = int(data_str[:split_idx])
-            rest = data[split_idx+1:]
-            header_end = 0
-            pipe_count = 0
-            for i, b in enumerate(rest):
-                if b == ord('|'):
-                    pipe_count += 1
-                    if pipe_count == 4:
-                        header_end = i + 1
-                        break
-            
-            if pipe_count < 4:
-                #print('[ERRO] Cabeçalho do pacote de dados incompleto.')
-                continue
-
-            header_bytes = rest[:header_end]
-            chunk = rest[header_end:]
-            #print('[PROCESSO] Verificando integridade do pacote (checksum)...')
-            calc_checksum = zlib.crc32(header_bytes + chunk)
-
-            if calc_checksum != received_checksum:
-                #print('[ERRO] Pacote corrompido (checksum inválido).')
-                continue
-
-            #print('[OK] Checksum válido!')
-            message = (header_bytes + chunk).decode(errors='ignore')
-            message_info = message.split("|", 4)
-            message_content = message_info[4]
-            arquivo_id = message_info[0]
-            num_pacote = message_info[1]
-            
-            ack_str = f"ACK|{arquivo_id}|{num_pacote}"
-            ack_checksum = zlib.crc32(ack_str.encode('utf-8'))
-            ack_packet = f"{ack_str}|{ack_checksum}".encode('utf-8')
-            #print(f"[ENVIO] Enviando ACK para {sender_addr} (ID={arquivo_id}, SEQ={num_pacote})")
-            client_socket.sendto(ack_packet, sender_addr)
-            last_ack_sent[arquivo_id] = ack_packet
-
-            while message_info[3] == "0":
-                #print('[PROCESSO] Aguardando próximo fragmento para montagem da mensagem completa...')
-                data, sender_addr = client_socket.recvfrom(BUFFER_SIZE)
-                data_str = data.decode(errors='ignore')
-                
-                if data_str.startswith('ACK|'):
-                    continue
-
-                split_idx = data_str.find('|')
-                if split_idx == -1: continue
-
-                received_checksum = int(data_str[:split_idx])
-                rest = data[split_idx+1:]
-                
-                header_end = 0
-                pipe_count = 0
-                for i, b in enumerate(rest):
-                    if b == ord('|'):
-                        pipe_count += 1
-                        if pipe_count == 4:
-                            header_end = i + 1
-                            break
-                if pipe_count < 4: continue
-
-                header_bytes = rest[:header_end]
-                chunk = rest[header_end:]
-                calc_checksum = zlib.crc32(header_bytes + chunk)
-
-                if calc_checksum != received_checksum:
-                    #print('[ERRO] Fragmento corrompido.')
-                    continue
-                
-                #print('[OK] Fragmento válido!')
-                message = (header_bytes + chunk).decode(errors='ignore')
-                message_info = message.split("|", 4)
-                message_content += message_info[4]
-                arquivo_id = message_info[0]
-                num_pacote = message_info[1]
-                
-                ack_str = f"ACK|{arquivo_id}|{num_pacote}"
-                ack_checksum = zlib.crc32(ack_str.encode('utf-8'))
-                ack_packet = f"{ack_str}|{ack_checksum}".encode('utf-8')
-                client_socket.sendto(ack_packet, sender_addr)
-                last_ack_sent[arquivo_id] = ack_packet
-            
-            message = message_content
-            print(f"{message}")
+        message = deliveries.get()
+        print(f"{message.decode(errors='ignore')}")
+        with display_lock:
+            display_backlog -= len(message)
 
+# Função que recebe mensagens do servidor (thread de recepção). Os ACKs atrasados e os
+# keepalives enviados ao servidor (se server_address for informado) ficam em
+# uma roda de temporizadores própria desta thread, e a espera por pacotes usa select para
+# acordar também nos seus prazos.
+def receive_message(client_socket, server_address=None):
+    if server_address is not None:
+        send_heartbeat(client_socket, server_address)
+    while True:
+        try:
+            ready, _, _ = select.select([client_socket], [], [], receive_scheduler.next_timeout())
+            if ready:
+                if batch_socket is not None:
+                    datagrams, sender_addr = batch_socket.recv_batch()
+                else:
+                    data, sender_addr = client_socket.recvfrom(BUFFER_SIZE)
+                    datagrams = [data]
+                for data in datagrams:
+                    handle_datagram(data, sender_addr, client_socket)
+            receive_scheduler.advance()
+            receiver.expire()
         except (ValueError, IndexError) as e:
             print(f"[AVISO] Erro ao processar pacote: {e}. Pacote ignorado.")
             continue
         except Exception as e:
-            print(f"Erro crítico na thread de recebimento: {e}")
+            print(f"Erro crítico na thread de recepção: {e}")
             break
 
-# Função para aguardar o ACK de um fragmento específico
-# Retorna True se ACK correto recebido, False se timeout
-# O socket deve estar em modo não-bloqueante para timeout
-def wait_for_ack(client_socket, arquivo_id, num_pacote, timeout=1.0):
-    start_time = time.time()
-    ack_key = (arquivo_id, str(num_pacote))
-    while time.time() - start_time < timeout:
-        with acks_lock:
-            if ack_key in received_acks:
-                del received_acks[ack_key]
-                return True
-        time.sleep(0.01)
-    return False
+# Envia um keepalive ao servidor e rearma o próximo, para que o servidor não remova da sala
+# um cliente ocioso (thread de recepção)
+def send_heartbeat(client_socket, server_address):
+    try:
+        client_socket.sendto(codec.encode_keepalive(), server_address)
+    except OSError:
+        pass
+    receive_scheduler.arm("heartbeat", rdt.HEARTBEAT_INTERVAL, partial(send_heartbeat, client_socket, server_address))
+
+# Retorna o envio confiável para o par (rdt.PeerSender), criado no primeiro envio
+def peer_sender(client_socket, address):
+    peer = peers.get(address)
+    if peer is None:
+        peer = peers[address] = rdt.PeerSender(address, client_socket, scheduler, stats, transmit=send_packets,
+                                               on_failure=send_failed, log=print_event)
+    return peer
+
+# Envia os fragmentos liberados juntos pela janela (em lote, se ativado)
+def send_packets(client_socket, packets, address):
+    if batch_socket is not None and len(packets) > 1:
+        batch_socket.send_batch(packets, address)
+    else:
+        rdt.send_packets(client_socket, packets, address)
+
+# Entrega abandonada (retransmissões ou sondas esgotadas): registra a falha, informada pelo
+# laço de envio após o advance() da roda, sem interromper os outros temporizadores do tick
+def send_failed(arquivo_id, reason):
+    send_failures[arquivo_id] = reason
+
+# Exibe um evento de retransmissão ou de sonda do envio
+def print_event(message, *args):
+    print(message % args)
+
+# Envia os fragmentos de uma mensagem com Selective Repeat: até window_size fragmentos
+# em trânsito (e não mais que a janela de congestionamento do servidor), cada um com seu
+# próprio temporizador de retransmissão na roda de temporizadores. O timeout é o RTO
+# calculado a partir do RTT medido com o servidor. received = (ACK cumulativo, SEQs) informa
+# fragmentos que o servidor já tem e que não precisam ser enviados.
+# A espera pelos ACKs não faz polling: a thread de recepção acorda esta espera assim que o
+# ACK chega.
+# Lança TimeoutError se um fragmento ficar sem ACK após rdt.MAX_RETRANSMISSIONS retransmissões.
+def send_fragments(client_socket, arquivo_id, fragments, window_size=rdt.WINDOW_SIZE,
+                   server_address=(SERVER_IP, SERVER_PORT), received=None):
+    peer = peer_sender(client_socket, server_address)
+    received_acks.register(arquivo_id)
+    try:
+        window = peer.start(arquivo_id, fragments, received, window_size)
+        while not window.done():
+            acks = received_acks.wait(arquivo_id, scheduler.next_timeout())
+            if acks is not None:
+                peer.on_ack(arquivo_id, *acks)
+            scheduler.advance()
+            stats.set_gauge("cwnd", round(peer.congestion.cwnd, 2))
+            stats.set_gauge("ssthresh", round(peer.congestion.ssthresh, 2))
+            if arquivo_id in send_failures:
+                raise TimeoutError(send_failures.pop(arquivo_id))
+    finally:
+        received_acks.unregister(arquivo_id)
+        peer.abandon(arquivo_id)
+        send_failures.pop(arquivo_id, None)
+
+# Retorna o timeout de retransmissão atual (RTO, em segundos) calculado para um par
+def current_rto(address=(SERVER_IP, SERVER_PORT)):
+    peer = peers.get(address)
+    return peer.rtt.rto if peer is not None else rdt.TIMEOUT
+
+# Consulta quais fragmentos de uma transferência o servidor já tem. Retorna (ACK cumulativo,
+# SEQs recebidos acima dele), ou None se o servidor não respondeu (transferência recusada).
+def query_missing(client_socket, file_id, server_address=(SERVER_IP, SERVER_PORT)):
+    received_acks.register(file_id)
+    try:
+        for _ in range(QUERY_ATTEMPTS):
+            client_socket.sendto(codec.encode_query(file_id), server_address)
+            acks = received_acks.wait(file_id, current_rto(server_address))
+            if acks is not None:
+                return acks[:2]
+        return None
+    finally:
+        received_acks.unregister(file_id)
+
+# Envia um arquivo com transferência retomável: anuncia o arquivo ao servidor (ID derivado
+# do arquivo, tamanho e payload por fragmento), consulta os fragmentos que ele já tem de uma
+# tentativa anterior e envia apenas os que faltam, lidos sob demanda do arquivo mapeado
+def send_file(client_socket, path, window_size=rdt.WINDOW_SIZE, server_address=(SERVER_IP, SERVER_PORT)):
+    file_id = transfer.transfer_id(path)
+    name = os.path.basename(path)
+    with fragmenter.fragment_file(path, file_id) as fragments:
+        announce = transfer.announce_message(file_id, name, os.path.getsize(path), fragmenter.payload_size)
+        arquivo_id = codec.new_message_id()
+        send_fragments(client_socket, arquivo_id, fragmenter.fragment(announce, arquivo_id), window_size, server_address)
+        received = query_missing(client_socket, file_id, server_address)
+        if received is None:
+            print(f"[ARQUIVO] O servidor não aceitou a transferência de {name}")
+            return
+        cumulative, seqs = received
+        missing = len(fragments) - min(cumulative, len(fragments)) - len(seqs)
+        print(f"[ARQUIVO] Enviando {name}: {missing} de {len(fragments)} fragmentos")
+        send_fragments(client_socket, file_id, fragments, window_size, server_address, received)
+    print(f"[ARQUIVO] {name} enviado")
 
 # Função de envio de mensagens do cliente, implementando RDT 3.0 para envio
-def send_message(client_socket):
+def send_message(client_socket, window_size=rdt.WINDOW_SIZE, server_address=(SERVER_IP, SERVER_PORT)):
     while True:
         message = input("Digite a mensagem para enviar: ")
-        path = write_message(message)
+        if message.startswith(SEND_FILE_COMMAND):
+            path = message[len(SEND_FILE_COMMAND):].strip()
+            try:
+                send_file(client_socket, path, window_size, server_address)
+            except OSError as e:
+                print(f"[ARQUIVO] Não foi possível enviar {path}: {e}")
+                print(f"[ARQUIVO] Para retomar a transferência, envie novamente: {SEND_FILE_COMMAND}{path}")
+            continue
+        if message == STATS_COMMAND:
+            print(f"métricas do cliente:\n{stats.summary()}")
         try:
-            fragments = Fragmentation(path)
-            # Para cada fragmento, envie e aguarde o ACK
-            for fragment in fragments:
-                # Extrai ID e número do pacote do fragmento
-                # O fragmento é: checksum|ID|SEQ|TOTAL|FLAG|<dados>
-                frag_str = fragment.decode(errors='ignore')
-                parts = frag_str.split('|', 6)
-                if len(parts) < 6:
-                    continue
-                arquivo_id = parts[1]
-                num_pacote = parts[2]
-                while True:
-                    client_socket.sendto(fragment, (SERVER_IP, SERVER_PORT))
-                    ack_ok = wait_for_ack(client_socket, arquivo_id, num_pacote, timeout=1.0)
-                    if ack_ok:
-                        break
-                    else:
-                        print(f"Timeout ou ACK incorreto para pacote {num_pacote}, reenviando...")
+            arquivo_id = codec.new_message_id()
+            compress = server_address in compression_peers
+            fragments = fragmenter.fragment(message, arquivo_id, compress)
+            send_fragments(client_socket, arquivo_id, fragments, window_size, server_address)
+        except TimeoutError as e:
+            print(f"Falha ao enviar mensagem: {e}")
         except Exception as e:
             print(f"Erro ao enviar mensagem: {e}")
             break
-        finally:
-            os.remove(path)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cliente do chat sobre UDP (RDT 3.0)")
+    parser.add_argument("--window", type=int, default=rdt.WINDOW_SIZE,
+                        help="número máximo de fragmentos em trânsito (janela Selective Repeat)")
+    parser.add_argument("--batch-io", action="store_true",
+                        help="envio e recepção em lote com UDP GSO/GRO (Linux)")
+    parser.add_argument("--server", type=config.parse_address, default=(SERVER_IP, SERVER_PORT),
+                        help="endereço do servidor (ip:porta), por exemplo o do proxy netem.py")
+    args = parser.parse_args()
     # Cria o socket UDP do cliente
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     client_socket.bind(('', 0))  
-    # Inicia thread para receber mensagens
-    threading.Thread(target=receive_message, args=(client_socket,), daemon=True).start()
+    if args.batch_io:
+        batch_socket = BatchSocket(client_socket, BUFFER_SIZE)
+    # Inicia as threads de recepção e de exibição das mensagens
+    threading.Thread(target=receive_message, args=(client_socket, args.server), daemon=True).start()
+    threading.Thread(target=display_messages, daemon=True).start()
     # Loop principal de envio
-    send_message(client_socket)
\ No newline at end of file
+    send_message(client_socket, args.window, args.server)
@@ -0,0 +1,52 @@
+import json
+import socket
+
+# Tamanho máximo de um evento de controle entre workers (um datagrama UDP em loopback)
+MAX_EVENT_SIZE = 65507
+# Buffer de recepção do socket de controle, para absorver rajadas de eventos sem perdas
+CONTROL_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class Cluster:
+    """
+    Canal de controle entre os workers do servidor (modo multiprocesso com SO_REUSEPORT).
+    O kernel distribui os clientes entre os workers pelo endereço de origem, de modo que
+    cada cliente é sempre atendido pelo mesmo worker, que guarda o estado RDT dele. Os
+    workers replicam entre si o registro de clientes (entrada e saída da sala) e repassam
+    os broadcasts, que cada worker entrega aos seus próprios clientes.
+    Os eventos são objetos JSON enviados por datagramas UDP em loopback a todos os outros
+    workers.
+    """
+
+    def __init__(self, index, sock, addresses):
+        self.index = index
+        self.sock = sock
+        self.peers = [address for i, address in enumerate(addresses) if i != index]
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    # Envia um evento a todos os outros workers
+    def publish(self, event):
+        data = json.dumps(event).encode('utf-8')
+        if len(data) > MAX_EVENT_SIZE:
+            raise ValueError(f"evento de controle grande demais ({len(data)} bytes)")
+        for peer in self.peers:
+            self.sock.sendto(data, peer)
+
+    # Lê um evento recebido de outro worker
+    def receive(self):
+        data, _ = self.sock.recvfrom(MAX_EVENT_SIZE)
+        return json.loads(data)
+
+
+# Cria os sockets de controle dos workers, um por worker, antes de criar os processos, para
+# que todos conheçam os endereços uns dos outros
+def create_control_sockets(workers, ip="127.0.0.1"):
+    sockets = []
+    for _ in range(workers):
+        control_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        control_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CONTROL_BUFFER_SIZE)
+        control_socket.bind((ip, 0))
+        sockets.append(control_socket)
+    return sockets
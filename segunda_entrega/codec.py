@@ -0,0 +1,278 @@
+import random
+import struct
+import uuid
+import zlib
+from collections import namedtuple
+
+# Versões do formato de pacote
+# 1: formato legado em texto  <CHECKSUM>|<UUID>|<SEQ>|<TOTAL>|<FLAG>|<DADOS>
+# 2: cabeçalho binário de tamanho fixo (ver HEADER)
+LEGACY_VERSION = 1
+PROTOCOL_VERSION = 2
+
+# Tipos de pacote
+DATA = 0
+ACK = 1
+# ACK cumulativo com bitmap SACK: SEQ é o ACK cumulativo (todos os fragmentos abaixo dele
+# chegaram) e o payload é um bitmap em que o bit i (byte i // 8, bit menos significativo
+# primeiro) indica que o fragmento SEQ + 1 + i chegou fora de ordem
+SACK = 2
+# Consulta do estado de uma mensagem: o receptor responde com o SACK atual. Usada para saber
+# os fragmentos ausentes de uma transferência de arquivo (o bitmap vai até onde couber no
+# datagrama) e como sonda de janela zero
+QUERY = 3
+# Keepalive: apenas o cabeçalho, enviado periodicamente pelo cliente para indicar que continua
+# ativo mesmo sem mensagens a enviar
+KEEPALIVE = 4
+
+# Flags do cabeçalho
+FLAG_END = 0x01
+# Pacote de dados: a mensagem (todos os fragmentos) foi comprimida com zlib antes da
+# fragmentação e deve ser descomprimida após a montagem
+FLAG_COMPRESSED = 0x02
+# ACK/SACK: o receptor aceita mensagens comprimidas (negociação da compressão)
+FLAG_ACCEPTS_COMPRESSED = 0x04
+# SACK: o campo TOTAL leva a janela de recepção anunciada, em fragmentos (quantos o receptor
+# ainda aceita em trânsito); sem a flag, o receptor não anuncia janela
+FLAG_WINDOW = 0x08
+# Pacote de dados: a mensagem é um lote de mensagens de chat curtas, cada uma precedida do seu
+# tamanho (BATCH_LENGTH); o receptor as separa após a montagem
+FLAG_BATCH = 0x10
+# ACK/SACK: o receptor aceita lotes de mensagens (negociação do agrupamento)
+FLAG_ACCEPTS_BATCH = 0x20
+
+# Nível de compressão zlib das mensagens e tamanho máximo aceito de uma mensagem descomprimida
+COMPRESSION_LEVEL = 6
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+# Cabeçalho binário v2 (24 bytes, big-endian):
+#   VERSION(1) TYPE(1) FLAGS(1) reservado(1) MSG_ID(8) SEQ(4) TOTAL(4) CRC32(4)
+# O CRC32 é calculado sobre os 20 primeiros bytes do cabeçalho e o payload.
+HEADER = struct.Struct("!BBBxQIII")
+HEADER_SIZE = HEADER.size
+_HEADER_NO_CRC = struct.Struct("!BBBxQII")
+_CRC = struct.Struct("!I")
+_CRC_OFFSET = _HEADER_NO_CRC.size
+
+# Tamanho de cada mensagem dentro de um lote (2 bytes, big-endian)
+BATCH_LENGTH = struct.Struct("!H")
+
+# Tamanho máximo do cabeçalho legado: checksum, UUID, SEQ, TOTAL e FLAG com seus separadores
+LEGACY_HEADER_MAX = 10 + 1 + 36 + 1 + 10 + 1 + 10 + 1 + 1 + 1
+
+# Pacote decodificado. Para v2, msg_id é inteiro; para o formato legado, é a string do UUID.
+# payload é um memoryview sobre o datagrama recebido (sem cópia).
+Packet = namedtuple("Packet", "version kind flags msg_id seq total payload")
+
+
+class PacketError(ValueError):
+    """Pacote mal formatado. msg_id é preenchido quando foi possível extraí-lo."""
+
+    def __init__(self, message, msg_id=None):
+        super().__init__(message)
+        self.msg_id = msg_id
+
+
+class ChecksumError(PacketError):
+    """Pacote com checksum inválido (corrompido)."""
+
+
+# Tamanho do cabeçalho de um pacote de dados da versão informada (no formato legado,
+# o maior tamanho possível, já que os campos em texto têm tamanho variável)
+def header_size(version=PROTOCOL_VERSION):
+    return LEGACY_HEADER_MAX if version == LEGACY_VERSION else HEADER_SIZE
+
+
+# Gera um identificador de mensagem no formato da versão informada
+def new_message_id(version=PROTOCOL_VERSION):
+    if version == LEGACY_VERSION:
+        return str(uuid.uuid4())
+    return random.getrandbits(64)
+
+
+# Monta um pacote de dados no formato da versão informada
+def encode_data(msg_id, seq, total, payload, flags=0, version=PROTOCOL_VERSION):
+    if version == LEGACY_VERSION:
+        flag_end = 1 if flags & FLAG_END else 0
+        header_str = f"{msg_id}|{seq}|{total}|{flag_end}|"
+        header_bytes = header_str.encode('utf-8')
+        checksum = zlib.crc32(payload, zlib.crc32(header_bytes))
+        return f"{checksum}|".encode('utf-8') + header_bytes + payload
+    header = _HEADER_NO_CRC.pack(PROTOCOL_VERSION, DATA, flags, msg_id, seq, total)
+    checksum = zlib.crc32(payload, zlib.crc32(header))
+    return b"".join((header, _CRC.pack(checksum), payload))
+
+
+# Monta o ACK de um fragmento no formato da versão informada
+def encode_ack(msg_id, seq, version=PROTOCOL_VERSION):
+    if version == LEGACY_VERSION:
+        ack_str = f"ACK|{msg_id}|{seq}"
+        ack_checksum = zlib.crc32(ack_str.encode('utf-8'))
+        return f"{ack_str}|{ack_checksum}".encode('utf-8')
+    header = _HEADER_NO_CRC.pack(PROTOCOL_VERSION, ACK, 0, msg_id, seq, 0)
+    return header + _CRC.pack(zlib.crc32(header))
+
+
+# Monta um SACK: ACK cumulativo, bitmap (bytes) dos fragmentos recebidos fora de ordem e, se
+# informada, a janela de recepção anunciada
+def encode_sack(msg_id, cumulative, bitmap=b"", flags=0, window=None):
+    if window is not None:
+        flags |= FLAG_WINDOW
+        window = min(window, 0xFFFFFFFF)
+    header = _HEADER_NO_CRC.pack(PROTOCOL_VERSION, SACK, flags, msg_id, cumulative, window or 0)
+    checksum = zlib.crc32(bitmap, zlib.crc32(header))
+    return b"".join((header, _CRC.pack(checksum), bitmap))
+
+
+# Monta a consulta de fragmentos ausentes de uma transferência
+def encode_query(msg_id):
+    header = _HEADER_NO_CRC.pack(PROTOCOL_VERSION, QUERY, 0, msg_id, 0, 0)
+    return header + _CRC.pack(zlib.crc32(header))
+
+
+# Monta um keepalive
+def encode_keepalive():
+    header = _HEADER_NO_CRC.pack(PROTOCOL_VERSION, KEEPALIVE, 0, 0, 0, 0)
+    return header + _CRC.pack(zlib.crc32(header))
+
+
+# Monta o bitmap SACK a partir dos números de sequência recebidos acima do ACK cumulativo
+def sack_bitmap(cumulative, seqs):
+    bits = 0
+    for seq in seqs:
+        bits |= 1 << (seq - cumulative - 1)
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+# Informação de confirmação de um ACK ou SACK: (ACK cumulativo, SEQs confirmados individualmente)
+def ack_info(packet):
+    if packet.kind != SACK:
+        return 0, (packet.seq,)
+    bits = int.from_bytes(packet.payload, 'little')
+    seqs = []
+    offset = packet.seq + 1
+    while bits:
+        if bits & 1:
+            seqs.append(offset)
+        bits >>= 1
+        offset += 1
+    return packet.seq, seqs
+
+
+# Janela de recepção anunciada em um SACK, em fragmentos, ou None se não houver
+def advertised_window(packet):
+    if packet.kind != SACK or not packet.flags & FLAG_WINDOW:
+        return None
+    return packet.total
+
+
+# Junta mensagens curtas (bytes) em um lote
+def pack_batch(messages):
+    return b"".join(BATCH_LENGTH.pack(len(message)) + message for message in messages)
+
+
+# Separa as mensagens de um lote. Lança PacketError se o lote estiver truncado.
+def split_batch(data):
+    messages = []
+    offset = 0
+    while offset < len(data):
+        if offset + BATCH_LENGTH.size > len(data):
+            raise PacketError("lote de mensagens truncado")
+        (length,) = BATCH_LENGTH.unpack_from(data, offset)
+        offset += BATCH_LENGTH.size
+        if offset + length > len(data):
+            raise PacketError("lote de mensagens truncado")
+        messages.append(bytes(data[offset:offset + length]))
+        offset += length
+    return messages
+
+
+# Comprime uma mensagem inteira. Retorna (dados, flags): se a compressão não reduzir o
+# tamanho, a mensagem segue sem compressão e sem FLAG_COMPRESSED.
+def compress(message):
+    compressed = zlib.compress(message, COMPRESSION_LEVEL)
+    if len(compressed) >= len(message):
+        return message, 0
+    return compressed, FLAG_COMPRESSED
+
+
+# Descomprime uma mensagem montada. Lança PacketError se os dados forem inválidos ou se a
+# mensagem descomprimida passar de MAX_DECOMPRESSED_SIZE.
+def decompress(data):
+    decompressor = zlib.decompressobj()
+    try:
+        message = decompressor.decompress(data, MAX_DECOMPRESSED_SIZE)
+    except zlib.error as e:
+        raise PacketError(f"mensagem comprimida inválida ({e})")
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise PacketError("mensagem comprimida incompleta ou grande demais")
+    return message
+
+
+# Decodifica um datagrama recebido, detectando a versão pelo primeiro byte.
+# Lança PacketError se o pacote estiver mal formatado e ChecksumError se estiver corrompido.
+def decode(data):
+    view = memoryview(data)
+    if len(view) == 0:
+        raise PacketError("pacote vazio")
+    if view[0] == PROTOCOL_VERSION:
+        return _decode_binary(view)
+    return _decode_legacy(view)
+
+
+def _decode_binary(view):
+    if len(view) < HEADER_SIZE:
+        raise PacketError("cabeçalho incompleto")
+    version, kind, flags, msg_id, seq, total, received_checksum = HEADER.unpack_from(view)
+    payload = view[HEADER_SIZE:]
+    calc_checksum = zlib.crc32(payload, zlib.crc32(view[:_CRC_OFFSET]))
+    if calc_checksum != received_checksum:
+        raise ChecksumError("checksum inválido", msg_id)
+    if kind == DATA and not seq < total:
+        raise PacketError("SEQ fora do total de fragmentos", msg_id)
+    return Packet(version, kind, flags, msg_id, seq, total, payload)
+
+
+def _decode_legacy(view):
+    head = bytes(view[:LEGACY_HEADER_MAX])
+    if head.startswith(b"ACK|"):
+        parts = bytes(view).split(b"|")
+        if len(parts) != 4:
+            raise PacketError("ACK mal formatado")
+        _, msg_id, seq, received_checksum = parts
+        ack_checksum = zlib.crc32(b"ACK|" + msg_id + b"|" + seq)
+        msg_id = msg_id.decode(errors='ignore')
+        if str(ack_checksum).encode() != received_checksum:
+            raise ChecksumError("checksum de ACK inválido", msg_id)
+        if not seq.isdigit():
+            raise PacketError("ACK mal formatado", msg_id)
+        return Packet(LEGACY_VERSION, ACK, 0, msg_id, int(seq), 0, view[len(view):])
+
+    # Localiza os 5 separadores do cabeçalho (checksum + 4 campos)
+    pipes = []
+    position = -1
+    for _ in range(5):
+        position = head.find(b"|", position + 1)
+        if position == -1:
+            break
+        pipes.append(position)
+    if not pipes:
+        raise PacketError("pacote sem checksum")
+    if len(pipes) < 5:
+        msg_id = head[pipes[0] + 1:pipes[1]].decode(errors='ignore') if len(pipes) > 1 else None
+        raise PacketError("cabeçalho incompleto", msg_id)
+
+    header_end = pipes[4] + 1
+    fields = head[pipes[0] + 1:header_end].split(b"|")
+    msg_id = fields[0].decode(errors='ignore')
+    if not (fields[1].isdigit() and fields[2].isdigit()):
+        raise PacketError("cabeçalho inválido", msg_id)
+    payload = view[header_end:]
+    calc_checksum = zlib.crc32(payload, zlib.crc32(view[pipes[0] + 1:header_end]))
+    if str(calc_checksum).encode() != head[:pipes[0]]:
+        raise ChecksumError("checksum inválido", msg_id)
+    seq, total = int(fields[1]), int(fields[2])
+    if not seq < total:
+        raise PacketError("SEQ fora do total de fragmentos", msg_id)
+    flags = FLAG_END if fields[3] == b"1" else 0
+    return Packet(LEGACY_VERSION, DATA, flags, msg_id, seq, total, payload)
@@ -0,0 +1,22 @@
+import os
+
+# Tamanho máximo de um datagrama do protocolo (cabeçalho + payload), em bytes. É a mesma
+# configuração para remetente e receptor: define o payload de cada fragmento e o buffer de
+# recepção. Pode ser alterado com a variável de ambiente RDT_DATAGRAM_SIZE, até o MTU local
+# ou tamanhos jumbo (o limite é o maior payload UDP sobre IPv4).
+DEFAULT_DATAGRAM_SIZE = 1024
+MAX_DATAGRAM_SIZE = 65507
+DATAGRAM_SIZE = int(os.environ.get("RDT_DATAGRAM_SIZE", DEFAULT_DATAGRAM_SIZE))
+
+if not 0 < DATAGRAM_SIZE <= MAX_DATAGRAM_SIZE:
+    raise ValueError(f"RDT_DATAGRAM_SIZE deve estar entre 1 e {MAX_DATAGRAM_SIZE}")
+
+# Clientes do formato legado usam um buffer de recepção fixo de 1024 bytes, portanto os
+# pacotes legados nunca passam desse tamanho
+LEGACY_DATAGRAM_SIZE = 1024
+
+
+# Converte "ip:porta" em (ip, porta), para as opções de linha de comando com endereços
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
@@ -0,0 +1,48 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Formato das linhas de log: as próprias mensagens já trazem a etiqueta ([RECEBIDO], [ERRO]...)
+FORMAT = "%(message)s"
+# Níveis aceitos pela opção --log-level
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que enfileira o registro sem formatá-lo: a interpolação dos argumentos
+    (estilo %) e a escrita ficam para a thread do QueueListener, fora do laço de recepção.
+    Os argumentos são lidos só no momento da formatação, portanto devem ser imutáveis
+    (números, strings, tuplas), como os usados pelo servidor.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+# Configura o logger informado: os registros habilitados pelo nível são enfileirados por um
+# DeferredQueueHandler e formatados e escritos em stream (padrão: stdout) por uma thread em
+# segundo plano. Registros abaixo do nível são descartados pelo próprio logger, antes de
+# qualquer formatação. Retorna o listener, parado automaticamente na saída do processo.
+def setup(logger, level=logging.INFO, stream=None):
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    listener = logging.handlers.QueueListener(records, handler)
+    for old_handler in list(logger.handlers):
+        logger.removeHandler(old_handler)
+    logger.addHandler(DeferredQueueHandler(records))
+    logger.setLevel(level)
+    logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# Para o listener antes da saída do processo (por exemplo, no fim de um worker), escrevendo os
+# registros pendentes, sem pará-lo de novo no atexit
+def stop(listener):
+    atexit.unregister(listener.stop)
+    listener.stop()
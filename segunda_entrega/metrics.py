@@ -0,0 +1,116 @@
+import bisect
+import json
+import os
+import time
+from collections import Counter
+
+# Limites superiores (em segundos) dos buckets dos histogramas de tempo: de 100 µs a ~52 s,
+# dobrando a cada bucket
+TIME_BUCKETS = [0.0001 * 2 ** i for i in range(20)]
+
+
+class Histogram:
+    """
+    Histograma de buckets fixos (por padrão, TIME_BUCKETS): observe() custa uma busca binária e
+    um incremento. Os percentis são estimados pelo limite superior do bucket que os contém.
+    """
+
+    def __init__(self, bounds=TIME_BUCKETS):
+        self.bounds = bounds
+        # Um bucket por limite e um último para valores acima do maior limite
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    # Estimativa do percentil p (0 a 100), limitada ao maior valor observado
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": {f"{bound:g}": count for bound, count in zip(self.bounds + [float("inf")], self.counts) if count},
+        }
+
+
+class Metrics:
+    """
+    Métricas de execução de um processo (cliente ou servidor): contadores por nome (pacotes
+    recebidos e enviados, checksums inválidos, cabeçalhos mal formados, retransmissões, ACKs
+    duplicados, mensagens expiradas...), medidores com o valor atual (por exemplo, a janela de
+    congestionamento) e histogramas de tempo (RTT e latência das mensagens).
+    As atualizações são baratas e sem trava; snapshot() retorna tudo em um dicionário
+    serializável em JSON.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        self.counters = Counter()
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1):
+        self.counters[name] += amount
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def snapshot(self, **extra):
+        now = self.clock()
+        snapshot = {
+            "timestamp": now,
+            "uptime": now - self.started,
+            "counters": dict(sorted(self.counters.items())),
+            "gauges": dict(sorted(self.gauges.items())),
+            "histograms": {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())},
+        }
+        snapshot.update(extra)
+        return snapshot
+
+    # Resumo em texto dos contadores, dos medidores e dos percentis dos histogramas (comando de chat /stats)
+    def summary(self):
+        lines = [f"{name}: {value}" for name, value in sorted(self.counters.items())]
+        lines += [f"{name}: {value:g}" for name, value in sorted(self.gauges.items())]
+        for name, histogram in sorted(self.histograms.items()):
+            if histogram.count:
+                lines.append(f"{name}: n={histogram.count} p50={histogram.percentile(50) * 1000:.1f}ms "
+                             f"p99={histogram.percentile(99) * 1000:.1f}ms max={histogram.max * 1000:.1f}ms")
+        return "\n".join(lines) or "sem métricas"
+
+    # Grava o snapshot em JSON no caminho informado, de forma atômica
+    def write(self, path, **extra):
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(**extra), file, indent=2)
+        os.replace(temporary, path)
@@ -0,0 +1,162 @@
+import argparse
+import heapq
+import itertools
+import random
+import selectors
+import socket
+import time
+from collections import Counter
+
+import codec
+import config
+
+# Emulador de rede com perdas em loopback: um proxy UDP entre client.py e server.py que
+# descarta, corrompe, duplica, reordena e atrasa datagramas nos dois sentidos, com sorteios
+# reproduzíveis (semente fixa).
+#
+#   python netem.py --listen 127.0.0.1:12346 --target 127.0.0.1:12345 --loss 0.05 --corrupt 0.01
+#   python client.py --server 127.0.0.1:12346
+
+BUFFER_SIZE = 65535
+
+
+class LossyProxy:
+    """
+    Proxy UDP com perdas. Cada cliente que envia para o endereço de escuta ganha um socket
+    próprio em direção ao destino, de modo que o servidor vê um endereço distinto por cliente,
+    e as respostas voltam ao cliente correspondente.
+    A cada datagrama, em qualquer sentido, são sorteados: descarte (loss), corrupção de um bit
+    (corrupt), duplicação (duplicate) e reordenação (reorder, que atrasa o datagrama em mais
+    reorder_delay segundos para que os seguintes o ultrapassem). Todo datagrama entregue sofre
+    o atraso delay ± jitter.
+    stats conta os eventos, e "retransmissions" conta os fragmentos de dados (mesmo ID e SEQ)
+    enviados mais de uma vez pelos remetentes, vistos no caminho.
+    """
+
+    def __init__(self, listen, target, loss=0.0, corrupt=0.0, duplicate=0.0, reorder=0.0,
+                 delay=0.0, jitter=0.0, reorder_delay=0.01, seed=0):
+        self.target = target
+        self.loss = loss
+        self.corrupt = corrupt
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder_delay = reorder_delay
+        self.random = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(listen)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ, None)
+        # Socket em direção ao destino de cada cliente: {endereço do cliente: socket}
+        self.upstreams = {}
+        # Datagramas aguardando o atraso: heap de (instante de entrega, ordem, socket, dados, destino)
+        self.pending = []
+        self.order = itertools.count()
+        self.stats = Counter()
+        # Fragmentos de dados já vistos: {(ID, SEQ)}
+        self.seen = set()
+
+    def address(self):
+        return self.sock.getsockname()
+
+    # Laço do proxy; termina quando stop (threading.Event) é acionado
+    def serve(self, stop=None):
+        while stop is None or not stop.is_set():
+            timeout = 0.1
+            if self.pending:
+                timeout = max(0.0, min(timeout, self.pending[0][0] - time.monotonic()))
+            for key, _ in self.selector.select(timeout):
+                data, address = key.fileobj.recvfrom(BUFFER_SIZE)
+                if key.data is None:
+                    self.forward(self.upstream(address), data, self.target)
+                else:
+                    self.forward(self.sock, data, key.data)
+            self.flush()
+
+    def close(self):
+        for sock in [self.sock, *self.upstreams.values()]:
+            self.selector.unregister(sock)
+            sock.close()
+        self.selector.close()
+
+    # Socket em direção ao destino para o cliente, criado no primeiro datagrama dele
+    def upstream(self, client_address):
+        sock = self.upstreams.get(client_address)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((self.sock.getsockname()[0], 0))
+            self.selector.register(sock, selectors.EVENT_READ, client_address)
+            self.upstreams[client_address] = sock
+        return sock
+
+    # Aplica as perdas sorteadas a um datagrama e agenda a entrega
+    def forward(self, sock, data, destination):
+        self.stats["received"] += 1
+        self.count_retransmission(data)
+        if self.random.random() < self.loss:
+            self.stats["dropped"] += 1
+            return
+        if self.random.random() < self.corrupt:
+            self.stats["corrupted"] += 1
+            corrupted = bytearray(data)
+            corrupted[self.random.randrange(len(corrupted))] ^= 1 << self.random.randrange(8)
+            data = bytes(corrupted)
+        copies = 1
+        if self.random.random() < self.duplicate:
+            self.stats["duplicated"] += 1
+            copies = 2
+        for _ in range(copies):
+            delay = max(0.0, self.delay + self.random.uniform(-self.jitter, self.jitter))
+            if self.random.random() < self.reorder:
+                self.stats["reordered"] += 1
+                delay += self.reorder_delay
+            heapq.heappush(self.pending, (time.monotonic() + delay, next(self.order), sock, data, destination))
+
+    # Entrega os datagramas cujo atraso já passou
+    def flush(self):
+        now = time.monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            _, _, sock, data, destination = heapq.heappop(self.pending)
+            try:
+                sock.sendto(data, destination)
+                self.stats["forwarded"] += 1
+            except OSError:
+                self.stats["errors"] += 1
+
+    # Conta fragmentos de dados repetidos (retransmissões do remetente)
+    def count_retransmission(self, data):
+        try:
+            packet = codec.decode(data)
+        except codec.PacketError:
+            return
+        if packet.kind != codec.DATA:
+            return
+        key = (packet.msg_id, packet.seq)
+        if key in self.seen:
+            self.stats["retransmissions"] += 1
+        else:
+            self.seen.add(key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proxy UDP com perdas entre cliente e servidor")
+    parser.add_argument("--listen", type=config.parse_address, default=("127.0.0.1", 12346),
+                        help="endereço em que o proxy recebe os clientes (ip:porta)")
+    parser.add_argument("--target", type=config.parse_address, default=("127.0.0.1", 12345),
+                        help="endereço do servidor (ip:porta)")
+    parser.add_argument("--loss", type=float, default=0.0, help="probabilidade de descarte")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="probabilidade de corromper um bit")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="probabilidade de duplicação")
+    parser.add_argument("--reorder", type=float, default=0.0, help="probabilidade de reordenação")
+    parser.add_argument("--delay", type=float, default=0.0, help="atraso de cada datagrama, em segundos")
+    parser.add_argument("--jitter", type=float, default=0.0, help="variação aleatória do atraso, em segundos")
+    parser.add_argument("--seed", type=int, default=0, help="semente dos sorteios")
+    args = parser.parse_args()
+    proxy = LossyProxy(args.listen, args.target, args.loss, args.corrupt, args.duplicate, args.reorder,
+                       args.delay, args.jitter, seed=args.seed)
+    print(f"Proxy em {proxy.address()[0]}:{proxy.address()[1]} -> {args.target[0]}:{args.target[1]}")
+    try:
+        proxy.serve()
+    except KeyboardInterrupt:
+        print(dict(proxy.stats))
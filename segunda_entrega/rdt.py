@@ -0,0 +1,899 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+import codec
+import config
+import metrics
+
+# Número padrão máximo de fragmentos que podem estar em trânsito (sem ACK) ao mesmo tempo por
+# mensagem; dentro desse limite, quem decide é a janela de congestionamento do par, que limita
+# os fragmentos em trânsito somando todas as mensagens para ele
+WINDOW_SIZE = 64
+# Clientes do formato legado juntam os fragmentos na ordem de chegada, sem olhar SEQ nem ID:
+# recebem em stop-and-wait, com um único fragmento em trânsito somando todas as mensagens
+LEGACY_WINDOW_SIZE = 1
+# Timeout inicial de retransmissão de um fragmento, em segundos, antes de haver medições de RTT
+TIMEOUT = 1.0
+# Limites do timeout de retransmissão calculado (RTO), em segundos
+MIN_RTO = 0.2
+MAX_RTO = 60.0
+# Número máximo de retransmissões de um fragmento antes de desistir da entrega
+MAX_RETRANSMISSIONS = 6
+# Um fragmento em trânsito é considerado perdido (retransmissão rápida) quando DUP_THRESH
+# SACKs confirmaram fragmentos posteriores a ele sem confirmá-lo
+DUP_THRESH = 3
+# ACK atrasado: fragmentos em ordem são confirmados em conjunto a cada ACK_EVERY fragmentos
+# ou após ACK_DELAY segundos, o que vier antes
+ACK_EVERY = 4
+ACK_DELAY = 0.02
+# Janela de congestionamento (em fragmentos): valor inicial, limites e limiar inicial de
+# slow start (sem limiar até a primeira perda)
+INITIAL_CWND = 4
+MIN_CWND = 1
+MAX_CWND = 1024
+INITIAL_SSTHRESH = MAX_CWND
+# Número máximo de fragmentos descritos no bitmap de um SACK
+SACK_BITS = 256
+# Limite padrão de bytes guardados em mensagens ainda incompletas
+REASSEMBLY_MAX_BYTES = 8 * 1024 * 1024
+# Tempo máximo, em segundos, sem novos fragmentos antes de descartar uma mensagem incompleta
+REASSEMBLY_TIMEOUT = 30.0
+# Intervalo, em segundos, entre os keepalives enviados pelo cliente ao servidor
+HEARTBEAT_INTERVAL = 5.0
+# Tempo máximo, em segundos, sem nenhum pacote de um par antes de considerá-lo inativo
+# (três keepalives perdidos seguidos)
+PEER_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+# Número máximo de mensagens já entregues lembradas para descartar retransmissões. Acima de
+# DELIVERED_MAX_ENTRIES / DELIVERED_TTL mensagens por segundo (cerca de 156), entradas ainda
+# dentro do horizonte de retransmissão são descartadas, e uma retransmissão tardia de uma
+# delas seria entregue de novo (contado em delivered_evictions)
+DELIVERED_MAX_ENTRIES = 65536
+# Tempo, em segundos, que uma mensagem entregue é lembrada após o último fragmento recebido:
+# o horizonte de retransmissão do remetente, que desiste após MAX_RETRANSMISSIONS
+# retransmissões com RTO de no máximo MAX_RTO
+DELIVERED_TTL = MAX_RTO * (MAX_RETRANSMISSIONS + 1)
+
+
+class SelectiveRepeatSender:
+    """
+    Janela de envio Selective Repeat para os fragmentos de uma mensagem.
+    Cada fragmento é confirmado individualmente; a base da janela só avança quando o
+    fragmento mais antigo é confirmado, e fragmentos além de base + window_size aguardam.
+    A janela também guarda, para cada fragmento em trânsito, o instante do último envio e
+    quantas vezes foi retransmitido; os temporizadores ficam a cargo de quem usa a janela.
+    A lista de pacotes não é copiada, de modo que vários destinatários podem compartilhar os
+    mesmos pacotes imutáveis.
+    """
+
+    def __init__(self, packets, window_size=WINDOW_SIZE):
+        self.packets = packets
+        self.window_size = window_size
+        self.base = 0
+        self.next_seq = 0
+        # Fragmentos confirmados acima da base (o estado ocupa no máximo uma janela)
+        self.acked = set()
+        # Estado dos fragmentos em trânsito: {SEQ: instante do último envio}, {SEQ: retransmissões}
+        self.sent_at = {}
+        self.retransmissions = {}
+        # SACKs que indicaram cada fragmento em trânsito como ausente: {SEQ: quantidade}, e
+        # fragmentos já retransmitidos pela retransmissão rápida
+        self.reports = {}
+        self.fast_retransmitted = set()
+        # Criação da janela, para medir a latência da mensagem até a última confirmação
+        self.created = time.monotonic()
+
+    def done(self):
+        return self.base >= len(self.packets)
+
+    # Retorna os números de sequência que passaram a caber na janela e ainda não foram enviados
+    # (nem confirmados de antemão por skip()), no máximo budget deles (o espaço livre nas
+    # janelas de congestionamento e de recepção do par)
+    def next_sendable(self, budget=None):
+        limit = min(self.base + self.window_size, len(self.packets))
+        if budget is None:
+            budget = limit
+        sendable = []
+        seq = self.next_seq
+        while seq < limit and len(sendable) < budget:
+            if seq not in self.acked:
+                sendable.append(seq)
+            seq += 1
+        self.next_seq = max(self.next_seq, seq)
+        return sendable
+
+    # Marca como já recebidos, antes do envio, os fragmentos abaixo de cumulative e os SEQs
+    # informados (retomada de uma transferência): eles nunca são enviados
+    def skip(self, cumulative, seqs):
+        self.base = self.next_seq = max(self.base, min(cumulative, len(self.packets)))
+        self.acked.update(seq for seq in seqs if self.base <= seq < len(self.packets))
+        while self.base in self.acked:
+            self.acked.remove(self.base)
+            self.base += 1
+        self.next_seq = self.base
+
+    # Registra o envio (ou a retransmissão) de um fragmento
+    def mark_sent(self, seq, now):
+        if seq in self.sent_at:
+            self.retransmissions[seq] = self.retransmissions.get(seq, 0) + 1
+            self.reports.pop(seq, None)
+        self.sent_at[seq] = now
+
+    # Amostra de RTT do fragmento, ou None se ele foi retransmitido (regra de Karn)
+    def rtt_sample(self, seq, now):
+        if seq not in self.sent_at or seq in self.retransmissions:
+            return None
+        return now - self.sent_at[seq]
+
+    # Fragmentos em trânsito confirmados por um ACK cumulativo e/ou individual (SACK)
+    def acked_in_flight(self, cumulative, seqs):
+        seqs = set(seqs)
+        return [seq for seq in self.sent_at if seq < cumulative or seq in seqs]
+
+    # Conta o SACK que confirmou pela primeira vez os fragmentos `acked` como um aviso de
+    # ausência para cada fragmento em trânsito anterior ao maior deles, e retorna os que já
+    # somam DUP_THRESH avisos. Cada fragmento é reportado uma única vez (depois, vale o
+    # timeout); uma simples reordenação, que logo é confirmada, não chega ao limiar.
+    def lost(self, acked):
+        if not acked:
+            return []
+        highest = max(acked)
+        lost = []
+        for seq in self.sent_at:
+            if seq < highest and seq not in self.fast_retransmitted:
+                self.reports[seq] = self.reports.get(seq, 0) + 1
+                if self.reports[seq] >= DUP_THRESH:
+                    lost.append(seq)
+        self.fast_retransmitted.update(lost)
+        return lost
+
+    # Marca o fragmento como confirmado e desliza a janela. Retorna False para ACKs duplicados
+    # ou fora da janela.
+    def ack(self, seq):
+        if seq < self.base or seq >= self.next_seq or seq in self.acked:
+            return False
+        self.acked.add(seq)
+        self.sent_at.pop(seq, None)
+        self.retransmissions.pop(seq, None)
+        self.reports.pop(seq, None)
+        self.fast_retransmitted.discard(seq)
+        while self.base in self.acked:
+            self.acked.remove(self.base)
+            self.base += 1
+        return True
+
+
+class RttEstimator:
+    """
+    Estimador de RTT de um par (Jacobson/Karels, como na RFC 6298): mantém o RTT suavizado
+    (srtt) e sua variação (rttvar) e calcula o timeout de retransmissão (rto).
+    Pela regra de Karn, amostras de fragmentos retransmitidos não devem ser passadas a sample(),
+    pois não se sabe a qual transmissão o ACK corresponde. A cada timeout, backoff() dobra o
+    rto até que uma nova amostra válida o recalcule; timeouts de fragmentos enviados antes do
+    último backoff pertencem ao mesmo evento de perda e não dobram o rto de novo.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, initial_rto=TIMEOUT):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.last_backoff = float("-inf")
+
+    # Incorpora uma medição de RTT (em segundos) e recalcula o rto
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    # Backoff exponencial após o timeout de um fragmento enviado no instante sent_at
+    def backoff(self, sent_at=None):
+        if sent_at is not None and sent_at < self.last_backoff:
+            return
+        self.rto = min(self.rto * 2, MAX_RTO)
+        self.last_backoff = time.monotonic()
+
+
+class CongestionWindow:
+    """
+    Controle de congestionamento AIMD de um par, no estilo do TCP Reno (RFC 5681), com a
+    janela (cwnd) medida em fragmentos. Em slow start (cwnd < ssthresh), cada fragmento
+    confirmado aumenta cwnd em 1, dobrando-a a cada RTT; depois, o aumento é de 1 fragmento
+    por RTT (aditivo). Uma perda indicada pelo SACK (retransmissão rápida) reduz cwnd à
+    metade (multiplicativo), e um timeout a reduz a MIN_CWND, voltando ao slow start.
+    Como no RttEstimator, perdas de fragmentos enviados antes da última redução pertencem ao
+    mesmo evento de perda e não reduzem a janela de novo. A janela só cresce enquanto limita
+    o envio (RFC 7661): mensagens curtas ou a janela Selective Repeat não a inflam além do
+    que de fato foi usado.
+    """
+
+    def __init__(self, initial=INITIAL_CWND, ssthresh=INITIAL_SSTHRESH):
+        self.cwnd = float(initial)
+        self.ssthresh = ssthresh
+        self.last_reduction = float("-inf")
+
+    # Aumenta a janela pelos fragmentos confirmados pela primeira vez, se havia in_flight
+    # fragmentos em trânsito (antes da confirmação) ocupando toda a janela
+    def on_ack(self, count, in_flight):
+        if in_flight < int(self.cwnd):
+            return
+        for _ in range(count):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, MAX_CWND)
+
+    # Perda indicada pelo SACK de um fragmento enviado no instante sent_at. Retorna True se a
+    # janela foi reduzida.
+    def on_loss(self, sent_at):
+        if not self._new_event(sent_at):
+            return False
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = self.ssthresh
+        return True
+
+    # Timeout de um fragmento enviado no instante sent_at. Retorna True se a janela foi reduzida.
+    def on_timeout(self, sent_at):
+        if not self._new_event(sent_at):
+            return False
+        self.ssthresh = max(self.cwnd / 2, 2 * MIN_CWND)
+        self.cwnd = MIN_CWND
+        return True
+
+    def _new_event(self, sent_at):
+        if sent_at is not None and sent_at < self.last_reduction:
+            return False
+        self.last_reduction = time.monotonic()
+        return True
+
+
+# Envia os pacotes a address pelo socket, um datagrama por pacote
+def send_packets(sock, packets, address):
+    for packet in packets:
+        sock.sendto(packet, address)
+
+
+class PeerSender:
+    """
+    Envio confiável para um par, o mesmo no cliente e no servidor: as janelas Selective
+    Repeat das mensagens em andamento para o par e o estado que elas compartilham, o
+    estimador de RTT (RttEstimator), a janela de congestionamento (CongestionWindow) e a
+    contagem dos fragmentos em trânsito somando todas as mensagens. A janela de
+    congestionamento e a última janela de recepção anunciada pelo par (em qualquer SACK)
+    limitam esse total: quando os ACKs liberam espaço, as mensagens que aguardavam continuam,
+    na ordem em que foram iniciadas. Uma mensagem nova, portanto, já respeita a janela que o
+    par anunciou para as anteriores.
+    Trata os ACKs e SACKs (amostras de RTT, retransmissão rápida e crescimento da janela), os
+    timeouts (backoff do RTO e redução da janela) e as sondas de janela zero, uma por par. Os
+    temporizadores ficam em `scheduler`, com chaves (endereço, ID, SEQ) e (endereço,
+    "probe"). transmit(sock, pacotes, endereço) envia os datagramas (por padrão,
+    send_packets); on_failure(ID, motivo) é chamado quando uma entrega é abandonada, e
+    log(formato, *args) recebe os eventos de retransmissão e de sonda. max_in_flight, se
+    informado, é um limite fixo de fragmentos em trânsito somando todas as mensagens (1 =
+    stop-and-wait, para clientes legados). Os contadores vão para `stats` (Metrics).
+    """
+
+    def __init__(self, address, sock, scheduler, stats=None, window_size=WINDOW_SIZE,
+                 transmit=send_packets, on_failure=None, log=None, max_in_flight=None):
+        self.address = address
+        self.sock = sock
+        self.scheduler = scheduler
+        self.stats = stats if stats is not None else metrics.Metrics()
+        self.window_size = window_size
+        self.max_in_flight = max_in_flight
+        self.transmit = transmit
+        self.on_failure = on_failure
+        self.log = log
+        self.rtt = RttEstimator()
+        self.congestion = CongestionWindow()
+        # Mensagens em andamento, na ordem de início: {ID: SelectiveRepeatSender}, e as que
+        # ainda têm fragmentos por enviar
+        self.sends = {}
+        self.unsent = {}
+        # Fragmentos em trânsito (sem ACK) somando todas as mensagens
+        self.in_flight = 0
+        # Janela de recepção anunciada pelo par (None até o primeiro anúncio) e sondas de
+        # janela zero enviadas sem resposta
+        self.receive_window = None
+        self.probes = 0
+
+    # Inicia a entrega de uma mensagem já fragmentada. received = (ACK cumulativo, SEQs)
+    # informa fragmentos que o par já tem e que não precisam ser enviados. Retorna a janela
+    # da mensagem.
+    def start(self, msg_id, packets, received=None, window_size=None):
+        window = SelectiveRepeatSender(packets, window_size or self.window_size)
+        if received is not None:
+            window.skip(*received)
+        self.stats.increment("messages_out")
+        if window.done():
+            return window
+        self.sends[msg_id] = self.unsent[msg_id] = window
+        self.pump()
+        return window
+
+    # Espaço livre para novos fragmentos: o menor entre a janela de congestionamento, a
+    # janela de recepção anunciada e max_in_flight, descontados os fragmentos em trânsito
+    def budget(self):
+        limit = int(self.congestion.cwnd)
+        if self.receive_window is not None:
+            limit = min(limit, self.receive_window)
+        if self.max_in_flight is not None:
+            limit = min(limit, self.max_in_flight)
+        return limit - self.in_flight
+
+    # Envia os fragmentos que cabem no espaço livre, na ordem de início das mensagens. Com a
+    # janela anunciada fechada e nada em trânsito, arma a sonda de janela zero.
+    def pump(self):
+        budget = self.budget()
+        for msg_id, window in list(self.unsent.items()):
+            if budget <= 0:
+                break
+            sendable = window.next_sendable(budget)
+            if sendable:
+                self.send(msg_id, window, sendable)
+                budget -= len(sendable)
+            if window.next_seq >= len(window.packets):
+                del self.unsent[msg_id]
+        if not self.zero_window():
+            self.scheduler.cancel((self.address, "probe"))
+        elif (self.address, "probe") not in self.scheduler:
+            self.arm_probe()
+
+    # Registra a janela de recepção anunciada em um SACK (None se o par não anuncia)
+    def advertise(self, window):
+        if window is not None:
+            self.receive_window = window
+            self.probes = 0
+
+    # A janela anunciada está fechada e não há fragmentos em trânsito cujos ACKs a reabririam,
+    # mas há fragmentos por enviar: o par deve ser sondado até que ela reabra
+    def zero_window(self):
+        return self.receive_window == 0 and not self.in_flight and bool(self.unsent)
+
+    # Envia (ou reenvia) os fragmentos seqs da mensagem e arma seus temporizadores
+    def send(self, msg_id, window, seqs):
+        packets = [window.packets[seq] for seq in seqs]
+        self.transmit(self.sock, packets, self.address)
+        self.stats.increment("packets_out", len(packets))
+        self.stats.increment("bytes_out", sum(len(packet) for packet in packets))
+        now = time.monotonic()
+        for seq in seqs:
+            if seq not in window.sent_at:
+                self.in_flight += 1
+            window.mark_sent(seq, now)
+            self.scheduler.arm((self.address, msg_id, seq), self.rtt.rto, partial(self.retransmit, msg_id, seq))
+
+    # Processa um ACK (cumulative=0 e um único SEQ) ou SACK de uma mensagem, com a janela de
+    # recepção anunciada (ou None), que vale para todas as mensagens do par. Retorna False se
+    # a mensagem não está em andamento.
+    def on_ack(self, msg_id, cumulative, seqs, receive_window=None):
+        self.advertise(receive_window)
+        window = self.sends.get(msg_id)
+        if window is None:
+            # ACK atrasado ou duplicado de uma mensagem já entregue
+            self.stats.increment("duplicate_acks")
+            self.pump()
+            return False
+        now = time.monotonic()
+        acked = window.acked_in_flight(cumulative, seqs)
+        # Um SACK sem fragmentos em trânsito é a resposta a uma sonda de janela zero
+        if not acked and window.sent_at:
+            self.stats.increment("duplicate_acks")
+        self.congestion.on_ack(len(acked), self.in_flight)
+        for seq in acked:
+            sample = window.rtt_sample(seq, now)
+            if sample is not None:
+                self.rtt.sample(sample)
+                self.stats.observe("rtt", sample)
+            if window.ack(seq):
+                self.in_flight -= 1
+            self.scheduler.cancel((self.address, msg_id, seq))
+        if window.done():
+            self.abandon(msg_id)
+            self.stats.observe("message_latency", now - window.created)
+        else:
+            # Retransmissão rápida dos fragmentos que os SACKs indicam como perdidos
+            lost = window.lost(acked)
+            for seq in lost:
+                self.stats.increment("fast_retransmissions")
+                if self.congestion.on_loss(window.sent_at[seq]):
+                    self.stats.increment("cwnd_reductions")
+                self._log("[RETRANSMISSÃO] Fragmento perdido segundo o SACK, reenviando para %s (ID=%s, SEQ=%d)",
+                          self.address, msg_id, seq)
+            if lost:
+                self.send(msg_id, window, lost)
+        self.pump()
+        return True
+
+    # Callback do temporizador: retransmite o fragmento cujo ACK não chegou a tempo,
+    # desistindo da entrega após MAX_RETRANSMISSIONS tentativas de um mesmo fragmento
+    def retransmit(self, msg_id, seq):
+        window = self.sends.get(msg_id)
+        if window is None or seq not in window.sent_at:
+            return
+        if window.retransmissions.get(seq, 0) >= MAX_RETRANSMISSIONS:
+            self.fail(msg_id, f"fragmento {seq} sem ACK após {MAX_RETRANSMISSIONS} retransmissões")
+            return
+        self.rtt.backoff(window.sent_at[seq])
+        if self.congestion.on_timeout(window.sent_at[seq]):
+            self.stats.increment("cwnd_reductions")
+        self.stats.increment("retransmissions")
+        self._log("[RETRANSMISSÃO] Reenviando pacote para %s (ID=%s, SEQ=%d, RTO=%.3fs)",
+                  self.address, msg_id, seq, self.rtt.rto)
+        self.send(msg_id, window, [seq])
+
+    # Arma a próxima sonda de janela zero, com backoff exponencial a cada sonda sem resposta
+    def arm_probe(self):
+        delay = min(self.rtt.rto * 2 ** self.probes, MAX_RTO)
+        self.scheduler.arm((self.address, "probe"), delay, self.probe)
+
+    # Callback do temporizador de sonda: com a janela anunciada fechada e nada em trânsito,
+    # pergunta o estado da mensagem mais antiga à espera (codec.QUERY); o SACK da resposta
+    # traz a janela atual. Desiste da entrega após MAX_RETRANSMISSIONS sondas sem resposta.
+    def probe(self):
+        if not self.zero_window():
+            return
+        msg_id = next(iter(self.unsent))
+        if self.probes >= MAX_RETRANSMISSIONS:
+            self.fail(msg_id, f"janela de recepção fechada após {MAX_RETRANSMISSIONS} sondas")
+            return
+        self.probes += 1
+        self.stats.increment("zero_window_probes")
+        self._log("[SONDA] Janela de %s fechada, sondando (ID=%s)", self.address, msg_id)
+        self.sock.sendto(codec.encode_query(msg_id), self.address)
+        self.arm_probe()
+
+    # Abandona a entrega (contada em send_failures) e avisa on_failure
+    def fail(self, msg_id, reason):
+        self.stats.increment("send_failures")
+        self.abandon(msg_id)
+        if self.on_failure is not None:
+            self.on_failure(msg_id, reason)
+
+    # Descarta uma entrega (concluída ou não) e seus temporizadores
+    def abandon(self, msg_id):
+        window = self.sends.pop(msg_id, None)
+        if window is None:
+            return
+        self.unsent.pop(msg_id, None)
+        for seq in window.sent_at:
+            self.scheduler.cancel((self.address, msg_id, seq))
+        self.in_flight -= len(window.sent_at)
+        if not self.sends:
+            self.scheduler.cancel((self.address, "probe"))
+
+    # Descarta todas as entregas em andamento (par removido)
+    def abandon_all(self):
+        for msg_id in list(self.sends):
+            self.abandon(msg_id)
+        self.scheduler.cancel((self.address, "probe"))
+
+    def _log(self, message, *args):
+        if self.log is not None:
+            self.log(message, *args)
+
+
+class AckRegistry:
+    """
+    Registro de ACKs com notificação direta, para remetentes que esperam em outra thread.
+    A thread de recepção chama notify() e acorda imediatamente quem está em wait(), sem
+    polling. Só são guardados ACKs de mensagens registradas: ACKs atrasados de mensagens
+    já concluídas são descartados.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # Por mensagem: [maior ACK cumulativo, SEQs confirmados ainda não consumidos, há novidade,
+        # última janela de recepção anunciada]
+        self.acks = {}
+
+    def register(self, msg_id):
+        with self.condition:
+            self.acks[msg_id] = [0, set(), False, None]
+
+    def unregister(self, msg_id):
+        with self.condition:
+            self.acks.pop(msg_id, None)
+
+    # Registra um ACK (cumulative=0 e um único SEQ) ou um SACK (ACK cumulativo, SEQs do bitmap
+    # e janela de recepção anunciada, se houver)
+    def notify(self, msg_id, cumulative, seqs, window=None):
+        with self.condition:
+            entry = self.acks.get(msg_id)
+            if entry is None:
+                return
+            entry[0] = max(entry[0], cumulative)
+            entry[1].update(seqs)
+            entry[2] = True
+            if window is not None:
+                entry[3] = window
+            self.condition.notify_all()
+
+    # Aguarda até que chegue alguma confirmação da mensagem ou até o timeout.
+    # Retorna o ACK cumulativo, (consumindo-os) os SEQs confirmados individualmente e a última
+    # janela anunciada, ou None se nenhuma confirmação chegou.
+    def wait(self, msg_id, timeout):
+        with self.condition:
+            entry = self.acks[msg_id]
+            if not self.condition.wait_for(lambda: entry[2], timeout):
+                return None
+            seqs = entry[1]
+            entry[1] = set()
+            entry[2] = False
+            return entry[0], seqs, entry[3]
+
+
+class ReassemblyBuffer:
+    """
+    Buffer de recepção Selective Repeat de uma mensagem: guarda os fragmentos por número de
+    sequência, aceitando-os fora de ordem, até que todos os TOTAL_PACKETS estejam presentes.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.fragments = {}
+        # Bytes de payload guardados, instante do primeiro e do último fragmento recebido
+        self.size = 0
+        self.created = 0.0
+        self.updated = 0.0
+        # ACK cumulativo: todos os fragmentos abaixo deste SEQ já chegaram
+        self.cumulative = 0
+
+    # Armazena o fragmento. Retorna False se for duplicado ou estiver fora do intervalo.
+    def add(self, seq, payload):
+        if seq >= self.total or seq in self.fragments:
+            return False
+        self.fragments[seq] = payload
+        self.size += len(payload)
+        while self.cumulative in self.fragments:
+            self.cumulative += 1
+        return True
+
+    # Bitmap SACK dos fragmentos recebidos fora de ordem, acima do ACK cumulativo
+    def sack_bitmap(self, limit=SACK_BITS):
+        first = self.cumulative + 1
+        last = min(first + limit, self.total)
+        return codec.sack_bitmap(self.cumulative, [seq for seq in range(first, last) if seq in self.fragments])
+
+    def complete(self):
+        return len(self.fragments) == self.total
+
+    # Junta os fragmentos em ordem
+    def assemble(self):
+        return b"".join(self.fragments[seq] for seq in range(self.total))
+
+
+class ReassemblyTable:
+    """
+    Tabela de mensagens em montagem, indexada por (endereço do remetente, ID da mensagem), que
+    permite montar várias mensagens de vários remetentes em paralelo.
+    As entradas ficam ordenadas pela atividade mais recente: mensagens sem novos fragmentos há
+    mais de `timeout` segundos expiram, e, se o total de bytes guardados passar de `max_bytes`,
+    as mensagens menos recentes são descartadas primeiro. Os bytes guardados também são
+    somados por remetente (peer_size), para dividir o limite entre eles.
+    """
+
+    def __init__(self, max_bytes=REASSEMBLY_MAX_BYTES, timeout=REASSEMBLY_TIMEOUT, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.size = 0
+        # Bytes guardados por remetente, apenas dos que têm mensagens em montagem: {endereço: bytes}
+        self.peer_size = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    # Parte do limite de bytes ainda livre para o remetente: max_bytes dividido igualmente
+    # entre os remetentes com mensagens em montagem (contando o próprio), menos o que ele já
+    # guarda
+    def peer_free(self, address):
+        peers = len(self.peer_size) + (address not in self.peer_size)
+        return self.max_bytes // peers - self.peer_size.get(address, 0)
+
+    # Guarda o fragmento do pacote. Retorna a mensagem montada (bytes) quando o fragmento
+    # completa a mensagem, ou None caso contrário.
+    def add(self, key, packet):
+        now = self.clock()
+        buffer = self.entries.get(key)
+        if buffer is None:
+            buffer = self.entries[key] = ReassemblyBuffer(packet.total)
+            buffer.created = now
+        else:
+            self.entries.move_to_end(key)
+        buffer.updated = now
+        if buffer.add(packet.seq, packet.payload):
+            self.size += len(packet.payload)
+            self.peer_size[key[0]] = self.peer_size.get(key[0], 0) + len(packet.payload)
+        if buffer.complete():
+            self._remove(key)
+            return buffer.assemble()
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+        return None
+
+    # Descarta as mensagens incompletas sem atividade há mais de `timeout` segundos.
+    # Retorna as chaves descartadas.
+    def expire(self):
+        deadline = self.clock() - self.timeout
+        expired = []
+        while self.entries:
+            key, buffer = next(iter(self.entries.items()))
+            if buffer.updated > deadline:
+                break
+            self._remove(key)
+            expired.append(key)
+        return expired
+
+    def _remove(self, key):
+        buffer = self.entries.pop(key)
+        self.size -= buffer.size
+        remaining = self.peer_size.get(key[0], 0) - buffer.size
+        if remaining > 0:
+            self.peer_size[key[0]] = remaining
+        else:
+            self.peer_size.pop(key[0], None)
+
+
+class ExpiringTable:
+    """
+    Dicionário limitado com expiração, para o estado que não pode crescer com o total de
+    mensagens de um processo de longa duração. As entradas ficam ordenadas pelo acesso mais
+    recente (get ou atribuição): as que passam de `ttl` segundos sem acesso expiram, e, acima
+    de `max_entries`, as menos recentes são descartadas primeiro (LRU).
+    Acertos e falhas de get(), descartes por capacidade de entradas ainda dentro do `ttl` e
+    expirações são contados em `stats` (Metrics), com o prefixo `name` (por exemplo,
+    delivered_hits); o teste `in` e peek() não contam acertos nem falhas.
+    """
+
+    def __init__(self, name, max_entries, ttl, stats=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = stats if stats is not None else metrics.Metrics()
+        self.clock = clock
+        self.hits = f"{name}_hits"
+        self.misses = f"{name}_misses"
+        self.evictions = f"{name}_evictions"
+        self.expirations = f"{name}_expirations"
+        # {chave: [valor, instante do último acesso]}, do acesso mais antigo ao mais recente
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # A chave existe e não expirou (sem renovar o prazo nem contar acerto ou falha)
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry[1] > self.clock() - self.ttl
+
+    # Guarda o valor. Acima de max_entries descarta as entradas menos recentes: as já vencidas
+    # contam como expiração, e as ainda dentro do ttl, como descarte por capacidade.
+    def __setitem__(self, key, value):
+        now = self.clock()
+        self.entries[key] = [value, now]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            _, entry = self.entries.popitem(last=False)
+            self.stats.increment(self.expirations if entry[1] <= now - self.ttl else self.evictions)
+
+    # Retorna o valor da chave (renovando o seu prazo) ou default se ela não existir ou tiver
+    # expirado
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        now = self.clock()
+        if entry is not None and entry[1] <= now - self.ttl:
+            del self.entries[key]
+            self.stats.increment(self.expirations)
+            entry = None
+        if entry is None:
+            self.stats.increment(self.misses)
+            return default
+        entry[1] = now
+        self.entries.move_to_end(key)
+        self.stats.increment(self.hits)
+        return entry[0]
+
+    # Retorna o valor da chave ou default, sem renovar o prazo nem contar acerto ou falha
+    def peek(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= self.clock() - self.ttl:
+            return default
+        return entry[0]
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    # Descarta as entradas sem acesso há mais de `ttl` segundos. Retorna quantas expiraram.
+    def expire(self):
+        deadline = self.clock() - self.ttl
+        expired = 0
+        while self.entries:
+            entry = next(iter(self.entries.values()))
+            if entry[1] > deadline:
+                break
+            self.entries.popitem(last=False)
+            expired += 1
+        self.stats.increment(self.expirations, expired)
+        return expired
+
+
+class SackReceiver:
+    """
+    Lado receptor do Selective Repeat com ACKs cumulativos e SACK. Monta as mensagens em uma
+    ReassemblyTable e confirma os fragmentos com pacotes SACK (ACK cumulativo + bitmap dos
+    fragmentos recebidos fora de ordem), de modo que um único datagrama confirma vários
+    fragmentos e indica exatamente quais faltam.
+    Fragmentos em ordem são confirmados em conjunto, a cada ack_every fragmentos ou após
+    ack_delay segundos (ACK atrasado, com temporizador no scheduler); fragmentos fora de ordem,
+    duplicados ou que completam a mensagem são confirmados na hora. Com ack_delay=0, todo
+    fragmento é confirmado imediatamente. Pacotes do formato legado recebem o ACK individual.
+    Fragmentos de transferências de arquivo registradas em `transfers` ({(endereço, ID):
+    FileTransfer}) são gravados em disco em vez de montados em memória, com as mesmas regras
+    de confirmação.
+    Todo SACK anuncia a janela de recepção do remetente: quantos fragmentos de payload_size
+    bytes ainda cabem na sua parte do limite de bytes da ReassemblyTable (dividido igualmente
+    entre os remetentes com mensagens em montagem), sem passar do espaço livre no limite
+    total, descontados os fragmentos guardados e os bytes de mensagens entregues que a
+    aplicação ainda não consumiu (backlog(), se informado). Assim, vários remetentes juntos
+    não ultrapassam o limite.
+    ack_flags são as flags de negociação levadas em todo SACK (compressão e, se quem usa o
+    receptor separa os lotes, codec.FLAG_ACCEPTS_BATCH).
+    Os contadores da recepção e o histograma do tempo de montagem vão para `stats` (Metrics).
+    """
+
+    def __init__(self, scheduler, ack_every=ACK_EVERY, ack_delay=ACK_DELAY, stats=None,
+                 payload_size=config.DATAGRAM_SIZE - codec.HEADER_SIZE, backlog=None,
+                 ack_flags=codec.FLAG_ACCEPTS_COMPRESSED):
+        self.scheduler = scheduler
+        self.ack_flags = ack_flags
+        self.stats = stats if stats is not None else metrics.Metrics()
+        self.payload_size = payload_size
+        self.backlog = backlog
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.reassembly = ReassemblyTable()
+        # Mensagens já entregues, para confirmar e descartar retransmissões: {(endereço, ID): TOTAL},
+        # lembradas pelo horizonte de retransmissão (DELIVERED_TTL) e limitadas em quantidade
+        self.delivered = ExpiringTable("delivered", DELIVERED_MAX_ENTRIES, DELIVERED_TTL, self.stats)
+        # Fragmentos em ordem recebidos e ainda não confirmados: {(endereço, ID): quantidade}
+        self.unacked = {}
+        # Transferências de arquivo em andamento, de cada remetente: {(endereço, ID): FileTransfer}
+        self.transfers = {}
+
+    # Processa um pacote de dados válido vindo de address. Retorna a mensagem montada (bytes,
+    # já descomprimida) quando o pacote a completa, ou None caso contrário.
+    def receive(self, packet, address, sock):
+        message_key = (address, packet.msg_id)
+        legacy = packet.version == codec.LEGACY_VERSION
+        if legacy:
+            sock.sendto(codec.encode_ack(packet.msg_id, packet.seq, packet.version), address)
+            self.stats.increment("acks_out")
+
+        transfer = self.transfers.get(message_key) if not legacy else None
+        if transfer is not None:
+            expected = transfer.cumulative
+            duplicate = not transfer.add(packet.seq, packet.payload)
+            if duplicate:
+                self.stats.increment("duplicate_fragments")
+            transfer.updated = self.reassembly.clock()
+            self.acknowledge(sock, address, packet.msg_id,
+                             transfer.complete() or duplicate or packet.seq != expected)
+            return None
+
+        if message_key in self.delivered:
+            # Retransmissão de uma mensagem já entregue: o único acerto contado da tabela, que
+            # também renova o prazo da entrada
+            self.delivered.get(message_key)
+            self.stats.increment("duplicate_fragments")
+            if not legacy:
+                self.flush(sock, address, packet.msg_id)
+            return None
+
+        buffer = self.reassembly.get(message_key)
+        expected = buffer.cumulative if buffer is not None else 0
+        duplicate = buffer is not None and packet.seq in buffer.fragments
+        if duplicate:
+            self.stats.increment("duplicate_fragments")
+        assembled = self.reassembly.add(message_key, packet)
+        if assembled is not None:
+            self.delivered[message_key] = packet.total
+            self.stats.increment("messages_in")
+            if buffer is not None:
+                self.stats.observe("reassembly_time", self.reassembly.clock() - buffer.created)
+        if legacy:
+            return assembled
+
+        self.acknowledge(sock, address, packet.msg_id,
+                         assembled is not None or duplicate or packet.seq != expected)
+        # A mensagem já foi confirmada: se a descompressão falhar (PacketError), ela é apenas
+        # descartada pelo chamador, sem que o remetente a reenvie
+        if assembled is not None and packet.flags & codec.FLAG_COMPRESSED:
+            return codec.decompress(assembled)
+        return assembled
+
+    # Janela de recepção anunciada ao remetente address, em fragmentos
+    def receive_window(self, address):
+        used = self.reassembly.size + (self.backlog() if self.backlog is not None else 0)
+        free = min(self.reassembly.max_bytes - used, self.reassembly.peer_free(address))
+        return max(0, free) // self.payload_size
+
+    # Confirma o fragmento recebido: na hora (immediate) ou com ACK atrasado
+    def acknowledge(self, sock, address, msg_id, immediate):
+        message_key = (address, msg_id)
+        if immediate or not self.ack_delay:
+            self.flush(sock, address, msg_id)
+            return
+        count = self.unacked.get(message_key, 0) + 1
+        if count >= self.ack_every:
+            self.flush(sock, address, msg_id)
+            return
+        self.unacked[message_key] = count
+        if count == 1:
+            self.scheduler.arm(("ack",) + message_key, self.ack_delay,
+                               partial(self.flush, sock, address, msg_id))
+
+    # Envia o SACK com o estado atual da mensagem e cancela o ACK atrasado pendente. O bitmap
+    # cobre até limit fragmentos acima do ACK cumulativo.
+    def flush(self, sock, address, msg_id, limit=SACK_BITS):
+        message_key = (address, msg_id)
+        self.scheduler.cancel(("ack",) + message_key)
+        self.unacked.pop(message_key, None)
+        transfer = self.transfers.get(message_key)
+        buffer = self.reassembly.get(message_key)
+        window = self.receive_window(address)
+        if transfer is not None:
+            sack = codec.encode_sack(msg_id, transfer.cumulative, transfer.sack_bitmap(limit), self.ack_flags, window)
+        elif buffer is not None:
+            sack = codec.encode_sack(msg_id, buffer.cumulative, buffer.sack_bitmap(limit), self.ack_flags, window)
+        else:
+            total = self.delivered.peek(message_key)
+            if total is None:
+                return
+            sack = codec.encode_sack(msg_id, total, flags=self.ack_flags, window=window)
+        self.send_sack(sock, address, sack, window)
+
+    # Envia um SACK já codificado, que anuncia a janela window
+    def send_sack(self, sock, address, sack, window):
+        sock.sendto(sack, address)
+        self.stats.increment("acks_out")
+        if not window:
+            self.stats.increment("zero_windows_out")
+
+    # Responde a uma consulta (codec.QUERY) com o SACK do estado da mensagem: de uma
+    # transferência, com o bitmap até onde couber em um datagrama de datagram_size bytes; de
+    # uma mensagem em montagem ou entregue, com o SACK usual. Toda consulta é respondida: a
+    # sonda de janela zero pergunta por uma mensagem que o remetente ainda não enviou, e o
+    # SACK vazio (ACK cumulativo 0, sem bitmap) leva a janela atual.
+    def answer_query(self, sock, address, msg_id, datagram_size):
+        message_key = (address, msg_id)
+        if message_key in self.transfers:
+            self.flush(sock, address, msg_id, (datagram_size - codec.HEADER_SIZE) * 8)
+        elif self.reassembly.get(message_key) is not None or message_key in self.delivered:
+            self.flush(sock, address, msg_id)
+        else:
+            window = self.receive_window(address)
+            self.send_sack(sock, address, codec.encode_sack(msg_id, 0, flags=self.ack_flags, window=window), window)
+
+    # Descarta as mensagens incompletas e as entregues além do horizonte de retransmissão.
+    # Retorna as chaves das mensagens incompletas descartadas.
+    def expire(self):
+        self.delivered.expire()
+        expired = self.reassembly.expire()
+        self.stats.increment("reassembly_timeouts", len(expired))
+        for message_key in expired:
+            self.scheduler.cancel(("ack",) + message_key)
+            self.unacked.pop(message_key, None)
+        return expired
@@ -1,26 +1,91 @@
+import argparse
+import asyncio
+import multiprocessing
+import selectors
 import socket
 import threading
+import time
 import datetime
-import os
-from Fragmentation import Fragmentation
+import logging
+from functools import partial
+from Fragmentation import Fragmenter
+from batch_io import BatchSocket
 from datetime import datetime
-import zlib
+import cluster
+import codec
+import config
+import logs
+import metrics
+import rdt
+import timers
+import transfer
 
 # Configurações do servidor
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 12345
-BUFFER_SIZE = 1024
+# Buffer de recepção: o mesmo tamanho de datagrama usado pelo remetente (e nunca menor que
+# o dos clientes legados)
+BUFFER_SIZE = max(config.DATAGRAM_SIZE, config.LEGACY_DATAGRAM_SIZE)
 
-# Dicionário de clientes conectados: {endereço: nome}
+# Logger do servidor: as linhas por pacote ficam no nível DEBUG, e a formatação e a escrita
+# acontecem em uma thread em segundo plano (logs.setup)
+logger = logging.getLogger("server")
+
+# Intervalo, em segundos, da varredura de mensagens incompletas
+REASSEMBLY_SWEEP_INTERVAL = 1.0
+# Intervalo padrão, em segundos, da gravação do snapshot das métricas em JSON
+METRICS_INTERVAL = 10.0
+# Atraso máximo padrão, em segundos, de uma mensagem curta na fila de saída de um cliente
+# antes do envio em lote (--coalesce-delay; 0 desativa o agrupamento)
+COALESCE_DELAY = 0.01
+# Sala em que os clientes entram ao se conectar (e para a qual voltam com /leave)
+DEFAULT_ROOM = "geral"
+# Tamanho máximo do nome de uma sala
+ROOM_NAME_MAX = 32
+
+# Dicionário de clientes conectados: {endereço: nome}. No modo multiprocesso, inclui os
+# clientes atendidos pelos outros workers.
 clients = {}
+# Clientes conectados atendidos por outros workers: {endereço}
+remote_clients = set()
+# Índice das salas: {sala: {endereço}} e {endereço: sala}, com os clientes de todos os
+# workers. Entrada, saída e consulta de membros custam O(1); salas vazias são removidas.
+rooms = {}
+client_rooms = {}
+# Canal de controle com os outros workers (apenas no modo multiprocesso)
+control = None
+# Versão do formato de pacote usada por cada cliente: {endereço: versão}
+client_versions = {}
+# Envio confiável por cliente: {endereço: rdt.PeerSender}, com as mensagens em andamento, o
+# estimador de RTT e a janela de congestionamento de cada um
+peers = {}
+# Clientes que aceitam mensagens comprimidas (anunciado nos SACKs): {endereço}
+compression_peers = set()
+# Clientes que aceitam lotes de mensagens (anunciado nos SACKs): {endereço}
+batch_peers = set()
+# Filas de saída por cliente, com as mensagens curtas que aguardam o envio em lote:
+# {endereço: [bytes do lote, [mensagens]]}. Uma única varredura ("coalesce") esvazia todas.
+outbound = {}
+coalesce_delay = COALESCE_DELAY
+# Temporizadores de retransmissão e de manutenção, disparados por uma única roda
+scheduler = timers.TimerWheel()
+# Métricas de execução (contadores e histogramas de RTT e latência), consultadas com o
+# comando /stats e gravadas periodicamente em metrics_file (--metrics-file), se informado
+stats = metrics.Metrics()
+metrics_file = None
+metrics_interval = METRICS_INTERVAL
+# Recepção Selective Repeat: montagem das mensagens de vários clientes em paralelo, com
+# confirmação por SACK e ACK atrasado
+receiver = rdt.SackReceiver(scheduler, stats=stats)
+# Envio e recepção em lote (GSO/GRO), ativados com --batch-io na engine bloqueante
+batch_socket = None
 
-# Função utilitária para salvar mensagens em arquivo temporário
-# (usado para fragmentação)
-def write_message(message):
-    path_name = f"server_{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.txt"
-    with open(path_name, "w", encoding="utf-8") as file:
-        file.write(message)
-    return path_name
+# Fragmentadores reutilizados por todos os envios (sem arquivos temporários),
+# um para cada versão do formato de pacote
+fragmenters = {
+    codec.PROTOCOL_VERSION: Fragmenter(),
+    codec.LEGACY_VERSION: Fragmenter(version=codec.LEGACY_VERSION),
+}
 
 # Formata a mensagem para exibição no chat
 def format_message(message, client_address, clients):
@@ -31,10 +96,26 @@ def format_message(message, client_address, clients):
 def is_connect_command(message): 
     return message[0:len("hi, meu nome eh ")] == "hi, meu nome eh "
 
+# Verifica se a mensagem é o comando de consulta das métricas do servidor
+def is_stats_command(message):
+    return message == "/stats"
+
 # Verifica se a mensagem é comando de saída
 def is_exit_command(message):
     return message == "bye"
 
+# Verifica se a mensagem é comando de troca de sala: /join <sala>
+def is_join_command(message):
+    return message[0:len("/join ")] == "/join "
+
+# Verifica se a mensagem é comando de volta à sala padrão
+def is_leave_command(message):
+    return message == "/leave"
+
+# Verifica se a mensagem é comando de consulta da sala atual
+def is_room_command(message):
+    return message == "/room"
+
 # Verifica se o cliente está na sala
 def is_client_in_room(client_address, room_clients):
     return client_address in room_clients
@@ -43,28 +124,39 @@ def is_client_in_room(client_address, room_clients):
 def catch_username(message):
     return message[len("hi, meu nome eh "):len(message)] 
 
-# Cria o socket UDP do servidor
-def create_server(ip, port):
+# Extrai o nome da sala do comando /join
+def catch_room(message):
+    return message[len("/join "):].strip()
+
+# Cria o socket UDP do servidor. Com reuse_port, vários processos podem se ligar à mesma
+# porta (SO_REUSEPORT), e o kernel distribui os clientes entre eles.
+def create_server(ip, port, reuse_port=False):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server_socket.bind((ip, port))
     return server_socket
 
-# Envia mensagem fragmentada para um cliente
+# Envia mensagem fragmentada para um cliente, com entrega confiável
 def send_message(message, server_socket, client_address):
-    path = write_message(message)
-    try:
-        fragments = Fragmentation(path)
-        [server_socket.sendto(fragment, client_address) for fragment in fragments]
-    except Exception as e:
-        print(f"Erro ao enviar mensagem: {e}")
-    finally:
-        os.remove(path)
+    notify_every_client([client_address], message, server_socket)
 
 # Mensagens de sistema para o chat
 def new_user_connection_message(new_user):
     return f"<{new_user}> foi conectado a sala"
 def user_logged_out_message(disconnected_user):
     return f"<{disconnected_user}> saiu da sala"
+def user_joined_room_message(user, room):
+    return f"<{user}> entrou na sala {room}"
+def user_changed_room_message(user, room):
+    return f"<{user}> foi para a sala {room}"
+def joined_room_message(room):
+    return f"você está na sala {room}"
+def invalid_room_message():
+    return f"nome de sala inválido: use de 1 a {ROOM_NAME_MAX} caracteres, sem espaços"
+def room_message(room):
+    members = sorted(clients[client] for client in rooms.get(room, ()))
+    return f"sala {room} ({len(members)} membros): {', '.join(members)}"
 def connected_message():
     return "conectado"
 def not_connected_message():
@@ -75,173 +167,586 @@ def server_new_connection_message(client_address):
     return f"Novo cliente conectado: {client_address}"
 def server_disconnected_user_message(client_address):
     return f"cliente desconectado: {client_address}"
+def stats_message():
+    update_congestion_gauges()
+    worker = f" (worker {control.index})" if control is not None else ""
+    return f"métricas do servidor{worker}:\n{stats.summary()}"
 def server_start_message(server_socket):
     return f"Servidor iniciado em {server_socket.getsockname()[0]}:{server_socket.getsockname()[1]}"
 
+# Envia a mensagem para todos os clientes. Mensagens curtas para clientes que aceitam lotes
+# vão para a fila de saída de cada um (enqueue_message); as demais são fragmentadas uma única
+# vez por versão do formato de pacote (e por suporte à compressão), e os pacotes (imutáveis)
+# são compartilhados entre os destinatários; cada destinatário tem apenas sua própria janela
+# Selective Repeat com o estado dos ACKs.
 def notify_every_client(clients, message, server_socket):
+    message = message.encode('utf-8')
+    fragmented = {}
     for client in clients:
-        send_message(message, server_socket, client)
+        try:
+            if not enqueue_message(server_socket, client, message):
+                send_content(server_socket, client, message, fragmented)
+        except Exception as e:
+            logger.error("[ERRO] Falha ao enviar mensagem para %s: %s", client, e)
+
+# Inicia a entrega confiável de um conteúdo a um cliente. fragmented guarda os pacotes já
+# montados por (versão, compressão, chave), para compartilhá-los entre os destinatários.
+def send_content(server_socket, client, content, fragmented, flags=0, key=None):
+    version = client_versions.get(client, codec.PROTOCOL_VERSION)
+    compress = client in compression_peers
+    cache_key = (version, compress, key)
+    if cache_key not in fragmented:
+        arquivo_id = codec.new_message_id(version)
+        fragmented[cache_key] = (arquivo_id, fragmenters[version].fragment(content, arquivo_id, compress, flags))
+    arquivo_id, fragments = fragmented[cache_key]
+    start_reliable_send(server_socket, client, arquivo_id, fragments)
+
+# Agrupamento no estilo de Nagle: coloca uma mensagem curta na fila de saída do cliente, que
+# é enviada em um único datagrama quando encher ou após coalesce_delay segundos. Retorna
+# False se a mensagem deve ser enviada diretamente (cliente sem suporte a lotes, agrupamento
+# desativado ou mensagem que não cabe em um fragmento, enviada depois da fila para manter a
+# ordem).
+def enqueue_message(server_socket, client, message):
+    if not coalesce_delay or client not in batch_peers:
+        return False
+    size = codec.BATCH_LENGTH.size + len(message)
+    capacity = fragmenters[codec.PROTOCOL_VERSION].payload_size
+    queue = outbound.get(client)
+    if queue is not None and queue[0] + size > capacity:
+        flush_outbound(server_socket, client)
+        queue = None
+    if size > capacity:
+        return False
+    if queue is None:
+        queue = outbound[client] = [0, []]
+    queue[0] += size
+    queue[1].append(message)
+    if "coalesce" not in scheduler:
+        scheduler.arm("coalesce", coalesce_delay, partial(flush_all_outbound, server_socket))
+    return True
+
+# Envia a fila de saída de um cliente: uma mensagem sozinha segue como mensagem comum, e
+# várias seguem em um lote (codec.FLAG_BATCH)
+def flush_outbound(server_socket, client, fragmented=None):
+    queue = outbound.pop(client, None)
+    if queue is None:
+        return
+    messages = queue[1]
+    if fragmented is None:
+        fragmented = {}
+    if len(messages) == 1:
+        send_content(server_socket, client, messages[0], fragmented, key=messages[0])
+        return
+    batch = codec.pack_batch(messages)
+    stats.increment("batches_out")
+    stats.increment("batched_messages", len(messages))
+    send_content(server_socket, client, batch, fragmented, codec.FLAG_BATCH, key=batch)
+
+# Callback do temporizador de agrupamento: esvazia as filas de saída de todos os clientes.
+# Clientes com a mesma fila (por exemplo, só broadcasts da sala) compartilham o lote.
+def flush_all_outbound(server_socket):
+    fragmented = {}
+    for client in list(outbound):
+        try:
+            flush_outbound(server_socket, client, fragmented)
+        except Exception as e:
+            logger.error("[ERRO] Falha ao enviar mensagem para %s: %s", client, e)
+
+# Clientes conectados atendidos por este processo
+def local_clients():
+    return [client for client in clients if client not in remote_clients]
+
+# Membros de uma sala atendidos por este processo
+def local_members(room):
+    return [client for client in rooms.get(room, ()) if client not in remote_clients]
+
+# Coloca o cliente na sala, saindo da anterior. Retorna a sala anterior (ou None).
+def join_room(client_address, room):
+    previous = leave_room(client_address)
+    rooms.setdefault(room, set()).add(client_address)
+    client_rooms[client_address] = room
+    return previous
+
+# Tira o cliente da sala atual, removendo a sala se ela ficar vazia. Retorna a sala (ou None).
+def leave_room(client_address):
+    room = client_rooms.pop(client_address, None)
+    if room is not None:
+        members = rooms[room]
+        members.discard(client_address)
+        if not members:
+            del rooms[room]
+    return room
+
+# Envia a mensagem a todos os clientes da sala: os deste processo diretamente e os dos outros
+# workers por meio do canal de controle
+def broadcast(message, server_socket, room):
+    notify_every_client(local_members(room), message, server_socket)
+    publish({"type": "broadcast", "room": room, "message": message})
+
+# Publica um evento para os outros workers, se houver
+def publish(event):
+    if control is None:
+        return
+    try:
+        control.publish(event)
+    except (OSError, ValueError) as e:
+        logger.error("[ERRO] Falha ao repassar evento aos outros workers: %s", e)
+
+# Aplica um evento recebido de outro worker: entrada e saída de clientes, troca de sala e
+# broadcast
+def handle_control_event(event, server_socket):
+    if event["type"] == "join":
+        client_address = tuple(event["address"])
+        clients[client_address] = event["name"]
+        remote_clients.add(client_address)
+        join_room(client_address, event["room"])
+    elif event["type"] == "leave":
+        client_address = tuple(event["address"])
+        clients.pop(client_address, None)
+        remote_clients.discard(client_address)
+        leave_room(client_address)
+    elif event["type"] == "room":
+        join_room(tuple(event["address"]), event["room"])
+    elif event["type"] == "broadcast":
+        notify_every_client(local_members(event["room"]), event["message"], server_socket)
+
+# Retorna o envio confiável para o cliente (rdt.PeerSender), criado no primeiro envio
+def peer_sender(server_socket, client_address):
+    peer = peers.get(client_address)
+    if peer is None:
+        # Clientes legados recebem em stop-and-wait; os demais, com a janela usual
+        limit = rdt.LEGACY_WINDOW_SIZE if client_versions.get(client_address) == codec.LEGACY_VERSION else None
+        peer = peers[client_address] = rdt.PeerSender(
+            client_address, server_socket, scheduler, stats, window_size=limit or rdt.WINDOW_SIZE,
+            transmit=send_packets, on_failure=partial(send_failed, server_socket, client_address),
+            log=logger.debug, max_in_flight=limit)
+    return peer
+
+# Inicia a entrega confiável de uma mensagem já fragmentada para um cliente
+def start_reliable_send(server_socket, client_address, arquivo_id, fragments):
+    if not fragments:
+        return
+    peer_sender(server_socket, client_address).start(arquivo_id, fragments)
+
+# Envia os fragmentos liberados juntos pela janela do cliente (em lote, se ativado)
+def send_packets(server_socket, packets, client_address):
+    if batch_socket is not None and len(packets) > 1:
+        batch_socket.send_batch(packets, client_address)
+    else:
+        rdt.send_packets(server_socket, packets, client_address)
+
+# Entrega abandonada (retransmissões ou sondas esgotadas): o cliente parou de responder e é
+# removido da sala
+def send_failed(server_socket, client_address, arquivo_id, reason):
+    logger.warning("[FALHA] Entrega para %s abandonada (ID=%s): %s", client_address, arquivo_id, reason)
+    evict_client(client_address, server_socket, "falha de entrega")
+
+# Processa um ACK ou SACK de fragmentos enviados pelo servidor
+def handle_ack(packet, client_address, server_socket):
+    if packet.flags & codec.FLAG_ACCEPTS_COMPRESSED:
+        compression_peers.add(client_address)
+    if packet.flags & codec.FLAG_ACCEPTS_BATCH:
+        batch_peers.add(client_address)
+    stats.increment("acks_in")
+    peer = peers.get(client_address)
+    if peer is None:
+        # ACK atrasado de um cliente já removido
+        stats.increment("duplicate_acks")
+        return
+    cumulative, seqs = codec.ack_info(packet)
+    peer.on_ack(packet.msg_id, cumulative, seqs, codec.advertised_window(packet))
+
+# Renova o prazo de inatividade do par a cada pacote válido recebido dele. Os prazos ficam na
+# roda de temporizadores, com chave ("alive", endereço), e só o par cujo prazo vence é
+# visitado, sem varrer a lista de clientes.
+def touch_client(client_address, server_socket):
+    scheduler.arm(("alive", client_address), rdt.PEER_TIMEOUT, partial(client_timeout, client_address, server_socket))
+
+# Prazo de inatividade vencido: um cliente da sala é removido e a saída é anunciada; o estado
+# de um par fora da sala (por exemplo, após o bye) é apenas descartado
+def client_timeout(client_address, server_socket):
+    if client_address in clients and client_versions.get(client_address) == codec.LEGACY_VERSION:
+        # Clientes legados não enviam keepalives: saem da sala com bye ou por falha de entrega
+        touch_client(client_address, server_socket)
+        return
+    evict_client(client_address, server_socket, "inatividade")
+
+# Remove da sala um cliente que parou de responder, descarta o estado mantido para ele e
+# anuncia a saída aos demais (e aos outros workers)
+def evict_client(client_address, server_socket, reason):
+    username = clients.pop(client_address, None)
+    room = leave_room(client_address)
+    forget_client(client_address)
+    if username is None:
+        return
+    publish({"type": "leave", "address": client_address})
+    stats.increment("clients_evicted")
+    logger.info("[INATIVO] Cliente %s removido da sala por %s (usuário: %s)", client_address, reason, username)
+    broadcast(user_logged_out_message(username), server_socket, room)
+
+# Descarta o estado por endereço de um par: prazo de inatividade, entregas pendentes,
+# estimador de RTT, janela de congestionamento, versão do protocolo, suporte a compressão e a
+# lotes e a fila de saída
+def forget_client(client_address):
+    scheduler.cancel(("alive", client_address))
+    peer = peers.pop(client_address, None)
+    if peer is not None:
+        peer.abandon_all()
+    client_versions.pop(client_address, None)
+    compression_peers.discard(client_address)
+    batch_peers.discard(client_address)
+    outbound.pop(client_address, None)
+
+# Valida um datagrama recebido. Retorna None se o pacote deve ser descartado.
+def receive_packet(data, client_address, server_socket):
+    stats.increment("packets_in")
+    stats.increment("bytes_in", len(data))
+    try:
+        packet = codec.decode(data)
+    except codec.ChecksumError:
+        # A perda é sinalizada ao remetente pelo SACK dos próximos fragmentos
+        logger.warning('[ERRO] Pacote corrompido de %s (checksum inválido).', client_address)
+        stats.increment("checksum_errors")
+        return None
+    except codec.PacketError as e:
+        logger.warning('[ERRO] Pacote mal formatado de %s (%s).', client_address, e)
+        stats.increment("malformed_packets")
+        return None
+    touch_client(client_address, server_socket)
+
+    # Keepalives só renovam o prazo de inatividade do cliente
+    if packet.kind == codec.KEEPALIVE:
+        stats.increment("keepalives_in")
+        return None
+
+    # ACKs de fragmentos enviados pelo servidor avançam a janela do cliente
+    if packet.kind in (codec.ACK, codec.SACK):
+        handle_ack(packet, client_address, server_socket)
+        return None
+    # Consulta dos fragmentos já recebidos de uma transferência de arquivo
+    if packet.kind == codec.QUERY:
+        receiver.answer_query(server_socket, client_address, packet.msg_id, config.DATAGRAM_SIZE)
+        return None
 
-# Função principal do servidor: implementa o RDT 3.0
-def start_server():
-    server_socket = create_server(SERVER_IP, SERVER_PORT)
-    print(server_start_message(server_socket))
+    logger.debug("[RECEBIDO] Pacote recebido de %s (%d bytes), checksum válido", client_address, len(data))
+    client_versions[client_address] = packet.version
+    return packet
 
-    # Dicionário para armazenar o último ACK enviado para cada mensagem (ID)
-    last_ack_sent = {}
+# Descarta mensagens incompletas que expiraram e fecha transferências de arquivo paradas (o
+# estado fica salvo em disco para a retomada); rearma a própria varredura periódica
+def expire_reassembly():
+    for expired_address, expired_id in receiver.expire():
+        logger.warning("[EXPIRADO] Mensagem incompleta de %s descartada (ID=%s)", expired_address, expired_id)
+    deadline = time.monotonic() - rdt.REASSEMBLY_TIMEOUT
+    for transfer_key, file_transfer in list(receiver.transfers.items()):
+        if file_transfer.updated < deadline:
+            file_transfer.close()
+            del receiver.transfers[transfer_key]
+            logger.warning("[EXPIRADO] Transferência de %s interrompida (%d/%d fragmentos salvos para retomada)",
+                           file_transfer.name, file_transfer.count, file_transfer.total)
+    scheduler.arm("reassembly", REASSEMBLY_SWEEP_INTERVAL, expire_reassembly)
+
+# Atualiza os medidores da janela de congestionamento dos clientes deste processo (menor,
+# média e maior)
+def update_congestion_gauges():
+    windows = [peer.congestion.cwnd for peer in peers.values()]
+    if windows:
+        stats.set_gauge("cwnd_min", round(min(windows), 2))
+        stats.set_gauge("cwnd_mean", round(sum(windows) / len(windows), 2))
+        stats.set_gauge("cwnd_max", round(max(windows), 2))
+
+# Grava o snapshot das métricas em JSON (por worker, no modo multiprocesso); rearma a
+# própria gravação periódica
+def write_metrics():
+    if metrics_file is None:
+        return
+    path = metrics_file if control is None else f"{metrics_file}.{control.index}"
+    update_congestion_gauges()
+    cwnd = {f"{client[0]}:{client[1]}": round(peer.congestion.cwnd, 2) for client, peer in peers.items()}
+    try:
+        stats.write(path, clients=len(local_clients()), pending_sends=sum(len(peer.sends) for peer in peers.values()),
+                    reassembly=len(receiver.reassembly), delivered=len(receiver.delivered),
+                    timers=len(scheduler), rooms=len(rooms), cwnd=cwnd)
+    except OSError as e:
+        logger.error("[ERRO] Falha ao gravar as métricas em %s: %s", path, e)
+    scheduler.arm("metrics", metrics_interval, write_metrics)
+
+# Registra a transferência de arquivo anunciada pelo cliente (ou retoma a já existente, em
+# memória ou salva em disco). As transferências em memória são indexadas por (endereço, ID),
+# de modo que só quem anunciou grava e consulta a sua. O estado em disco é indexado pelo ID:
+# um novo anúncio do mesmo ID por outro endereço (o remetente reconectado, com outra porta)
+# fecha a entrada antiga, salvando o estado, e a retomada continua com o novo endereço.
+def start_transfer(message, client_address, server_socket):
+    try:
+        file_id, size, payload_size, name = transfer.parse_announce(message, receiver.payload_size)
+    except ValueError as e:
+        logger.warning("[ERRO] Anúncio de arquivo inválido de %s: %s", client_address, e)
+        send_message(f"arquivo recusado: {e}", server_socket, client_address)
+        return
+    for transfer_key in [key for key in receiver.transfers if key[1] == file_id and key[0] != client_address]:
+        receiver.transfers.pop(transfer_key).close()
+    file_transfer = receiver.transfers.get((client_address, file_id))
+    if file_transfer is None:
+        file_transfer = transfer.FileTransfer(transfer.RECEIVED_FILES_DIR, file_id, name, size, payload_size)
+        receiver.transfers[(client_address, file_id)] = file_transfer
+    file_transfer.updated = time.monotonic()
+    logger.info("[ARQUIVO] Recebendo %s de %s (%d/%d fragmentos já recebidos)",
+                name, client_address, file_transfer.count, file_transfer.total)
+    if file_transfer.complete():
+        finish_transfer(file_transfer, client_address, server_socket)
+
+# Conclui uma transferência de arquivo e avisa a sala
+def finish_transfer(file_transfer, client_address, server_socket):
+    del receiver.transfers[(client_address, file_transfer.transfer)]
+    receiver.delivered[(client_address, file_transfer.transfer)] = file_transfer.total
+    path = file_transfer.finish()
+    logger.info("[ARQUIVO] %s recebido de %s (%d bytes), salvo em %s", file_transfer.name, client_address, file_transfer.size, path)
+    if client_address in clients:
+        broadcast(f"<{clients[client_address]}> enviou o arquivo {file_transfer.name} ({file_transfer.size} bytes)",
+                  server_socket, client_rooms[client_address])
+
+# Troca o cliente de sala (comandos /join e /leave), avisando a sala que ele deixa e a sala
+# em que ele entra
+def change_room(client_address, room, server_socket):
+    username = clients[client_address]
+    if room == client_rooms[client_address]:
+        send_message(joined_room_message(room), server_socket, client_address)
+        return
+    previous = leave_room(client_address)
+    logger.info("[SALA] Cliente %s (usuário: %s) trocou a sala %s pela sala %s", client_address, username, previous, room)
+    send_message(joined_room_message(room), server_socket, client_address)
+    broadcast(user_changed_room_message(username, room), server_socket, previous)
+    broadcast(user_joined_room_message(username, room), server_socket, room)
+    join_room(client_address, room)
+    publish({"type": "room", "address": client_address, "room": room})
+
+# Lógica de chat: conexão, desconexão, salas e broadcast
+def handle_chat_message(message, client_address, server_socket):
+    if not is_client_in_room(client_address, clients) and is_connect_command(message):
+        logger.info("[CONEXÃO] Conexão recebida de %s", client_address)
+        username = catch_username(message)
+        logger.info("[CONEXÃO] Novo cliente conectado: %s (usuário: %s)", client_address, username)
+        send_message(connected_message(), server_socket, client_address)
+        broadcast(new_user_connection_message(username), server_socket, DEFAULT_ROOM)
+        clients[client_address] = username 
+        join_room(client_address, DEFAULT_ROOM)
+        publish({"type": "join", "address": client_address, "name": username, "room": DEFAULT_ROOM})
+    elif not is_client_in_room(client_address, clients) and not is_connect_command(message):
+        logger.warning("[ERRO] Cliente %s tentou enviar mensagem sem estar conectado.", client_address)
+        send_message(not_connected_message(),server_socket, client_address)
+    elif is_stats_command(message):
+        send_message(stats_message(), server_socket, client_address)
+    elif transfer.is_announce(message):
+        start_transfer(message, client_address, server_socket)
+    elif is_join_command(message):
+        room = catch_room(message)
+        if not room or len(room) > ROOM_NAME_MAX or any(char.isspace() for char in room):
+            send_message(invalid_room_message(), server_socket, client_address)
+        else:
+            change_room(client_address, room, server_socket)
+    elif is_leave_command(message):
+        change_room(client_address, DEFAULT_ROOM, server_socket)
+    elif is_room_command(message):
+        send_message(room_message(client_rooms[client_address]), server_socket, client_address)
+    elif is_exit_command(message):
+        disconnected_user = clients[client_address]
+        del clients[client_address]
+        room = leave_room(client_address)
+        publish({"type": "leave", "address": client_address})
+        logger.info("[DESCONECTADO] Cliente desconectado: %s (usuário: %s)", client_address, disconnected_user)
+        send_message(disconnected_message(), server_socket, client_address)
+        broadcast(user_logged_out_message(disconnected_user), server_socket, room)
+    else:
+        formatted_message = format_message(message, client_address, clients)
+        logger.info("[MENSAGEM] Mensagem recebida de %s (sala %s): %s", client_address, client_rooms[client_address], formatted_message)
+        broadcast(formatted_message, server_socket, client_rooms[client_address])
+
+# Processa um datagrama recebido: implementa o RDT 3.0 do lado do receptor.
+# server_socket pode ser um socket UDP ou um transporte asyncio (ambos oferecem sendto).
+def handle_datagram(data, client_address, server_socket):
+    # 1. Valida (checksum) o pacote UDP do cliente
+    packet = receive_packet(data, client_address, server_socket)
+    if packet is None:
+        return
+    # 2. Guarda o fragmento, mesmo fora de ordem, e o confirma com SACK (imediato ou atrasado).
+    # Fragmentos de uma transferência de arquivo vão direto para o disco.
+    file_transfer = receiver.transfers.get((client_address, packet.msg_id))
+    try:
+        assembled = receiver.receive(packet, client_address, server_socket)
+    except codec.PacketError as e:
+        logger.warning('[ERRO] Mensagem de %s descartada (ID=%s): %s', client_address, packet.msg_id, e)
+        return
+    if file_transfer is not None:
+        if file_transfer.complete():
+            finish_transfer(file_transfer, client_address, server_socket)
+        return
+    if assembled is None:
+        logger.debug('[PROCESSO] Fragmento guardado (ID=%s, SEQ=%d), aguardando a mensagem completa...', packet.msg_id, packet.seq)
+        return
+    # 3. Lógica de chat
+    handle_chat_message(assembled.decode(errors='ignore'), client_address, server_socket)
+
+# Função principal do servidor (engine bloqueante): um laço de select sobre o socket UDP (e,
+# no modo multiprocesso, o canal de controle) cujo timeout é o tempo até o próximo
+# temporizador da roda
+# Com batch_io, envia e recebe em lote usando UDP GSO/GRO (Linux).
+def start_server(ip=SERVER_IP, port=SERVER_PORT, batch_io=False, reuse_port=False):
+    global batch_socket
+    server_socket = create_server(ip, port, reuse_port)
+    if batch_io:
+        batch_socket = BatchSocket(server_socket, BUFFER_SIZE)
+        logger.info("[INFO] Envio em lote (GSO): %s, recepção em lote (GRO): %s", batch_socket.gso, batch_socket.gro)
+    logger.info(server_start_message(server_socket))
+    expire_reassembly()
+    write_metrics()
+    selector = selectors.DefaultSelector()
+    selector.register(server_socket, selectors.EVENT_READ, receive_datagrams)
+    if control is not None:
+        selector.register(control, selectors.EVENT_READ, receive_control_event)
     while True:
-        # 1. Recebe pacote UDP do cliente
+        for key, _ in selector.select(scheduler.next_timeout()):
+            key.data(server_socket)
+        scheduler.advance()
+
+# Lê e processa os datagramas disponíveis no socket do servidor
+def receive_datagrams(server_socket):
+    if batch_socket is not None:
+        datagrams, client_address = batch_socket.recv_batch()
+    else:
         data, client_address = server_socket.recvfrom(BUFFER_SIZE)
-        data_str = data.decode(errors='ignore')
-        
-        # Ignora pacotes de ACK recebidos do cliente
-        if data_str.startswith('ACK|'):
-            print(f"[INFO] ACK recebido de {client_address}, ignorando.")
-            continue
-
-        print(f"[RECEBIDO] Pacote recebido de {client_address} ({len(data)} bytes)")
-        split_idx = data_str.find('|')
-        if split_idx == -1:
-            print('[ERRO] Pacote mal formatado (sem checksum).')
-            # Não é possível extrair ID, não reenviar ACK
-            continue
-        received_checksum = int(data_str[:split_idx])
-        rest = data[split_idx+1:]
-        # 2. Procura o fim do cabeçalho (quarto '|')
-        header_end = 0
-        pipe_count = 0
-        for i, b in enumerate(rest):
-            if b == ord('|'):
-                pipe_count += 1
-                if pipe_count == 4:
-                    header_end = i + 1
-                    break
-        if pipe_count < 4:
-            print('[ERRO] Cabeçalho incompleto.')
-            # Tenta extrair ID e reenviar último ACK, se possível
-            try:
-                header_str = rest[:].decode(errors='ignore')
-                header_parts = header_str.split('|')
-                arquivo_id = header_parts[0]
-                if arquivo_id in last_ack_sent:
-                    print(f"[RETRANSMISSÃO] Reenviando último ACK para ID={arquivo_id}")
-                    server_socket.sendto(last_ack_sent[arquivo_id], client_address)
-            except Exception:
-                pass
-            continue
-        header_bytes = rest[:header_end]
-        chunk = rest[header_end:]
-        print('[PROCESSO] Verificando integridade do pacote (checksum)...')
-        calc_checksum = zlib.crc32(header_bytes + chunk)
-        if calc_checksum != received_checksum:
-            print('[ERRO] Pacote corrompido (checksum inválido).')
-            # Tenta extrair ID e reenviar último ACK, se possível
-            try:
-                header_str = header_bytes.decode(errors='ignore')
-                header_parts = header_str.split('|')
-                arquivo_id = header_parts[0]
-                if arquivo_id in last_ack_sent:
-                    print(f"[RETRANSMISSÃO] Reenviando último ACK para ID={arquivo_id}")
-                    server_socket.sendto(last_ack_sent[arquivo_id], client_address)
-            except Exception:
-                pass
-            continue
-        print('[OK] Checksum válido!')
-        # 3. Decodifica o pacote e extrai informações do cabeçalho
-        message = (header_bytes + chunk).decode(errors='ignore')
-        message_info = message.split("|", 4)
-        message_content = message_info[4]
-        arquivo_id = message_info[0]
-        num_pacote = message_info[1]
-        # 4. Monta e envia o ACK para o cliente
-        ack_str = f"ACK|{arquivo_id}|{num_pacote}"
-        ack_checksum = zlib.crc32(ack_str.encode('utf-8'))
-        ack_packet = f"{ack_str}|{ack_checksum}".encode('utf-8')
-        print(f"[ENVIO] Enviando ACK para {client_address} (ID={arquivo_id}, SEQ={num_pacote})")
-        server_socket.sendto(ack_packet, client_address)
-        last_ack_sent[arquivo_id] = ack_packet
-        # 5. Monta a mensagem completa caso seja fragmentada
-        while message_info[3] == "0":
-            print('[PROCESSO] Aguardando próximo fragmento para montagem da mensagem completa...')
-            data, client_address = server_socket.recvfrom(BUFFER_SIZE)
-            print(f"[RECEBIDO] Pacote recebido de {client_address} ({len(data)} bytes)")
-            data_str = data.decode(errors='ignore')
-            split_idx = data_str.find('|')
-            if split_idx == -1:
-                print('[ERRO] Pacote mal formatado (sem checksum).')
-                continue
-            received_checksum = int(data_str[:split_idx])
-            rest = data[split_idx+1:]
-            header_end = 0
-            pipe_count = 0
-            for i, b in enumerate(rest):
-                if b == ord('|'):
-                    pipe_count += 1
-                    if pipe_count == 4:
-                        header_end = i + 1
-                        break
-            if pipe_count < 4:
-                print('[ERRO] Cabeçalho incompleto.')
-                try:
-                    header_str = rest[:].decode(errors='ignore')
-                    header_parts = header_str.split('|')
-                    arquivo_id = header_parts[0]
-                    if arquivo_id in last_ack_sent:
-                        print(f"[RETRANSMISSÃO] Reenviando último ACK para ID={arquivo_id}")
-                        server_socket.sendto(last_ack_sent[arquivo_id], client_address)
-                except Exception:
-                    pass
-                continue
-            header_bytes = rest[:header_end]
-            chunk = rest[header_end:]
-            print('[PROCESSO] Verificando integridade do pacote (checksum)...')
-            calc_checksum = zlib.crc32(header_bytes + chunk)
-            if calc_checksum != received_checksum:
-                print('[ERRO] Pacote corrompido (checksum inválido).')
-                try:
-                    header_str = header_bytes.decode(errors='ignore')
-                    header_parts = header_str.split('|')
-                    arquivo_id = header_parts[0]
-                    if arquivo_id in last_ack_sent:
-                        print(f"[RETRANSMISSÃO] Reenviando último ACK para ID={arquivo_id}")
-                        server_socket.sendto(last_ack_sent[arquivo_id], client_address)
-                except Exception:
-                    pass
-                continue
-            print('[OK] Checksum válido!')
-            message = (header_bytes + chunk).decode(errors='ignore')
-            message_info = message.split("|", 4)
-            message_content += message_info[4]
-            arquivo_id = message_info[0]
-            num_pacote = message_info[1]
-            ack_str = f"ACK|{arquivo_id}|{num_pacote}"
-            ack_checksum = zlib.crc32(ack_str.encode('utf-8'))
-            ack_packet = f"{ack_str}|{ack_checksum}".encode('utf-8')
-            print(f"[ENVIO] Enviando ACK para {client_address} (ID={arquivo_id}, SEQ={num_pacote})")
-            server_socket.sendto(ack_packet, client_address)
-            last_ack_sent[arquivo_id] = ack_packet
-        message = message_content
-        # 6. Lógica de chat: conexão, desconexão e broadcast
-        if not is_client_in_room(client_address, clients) and is_connect_command(message):
-            print(f"[CONEXÃO] Conexão recebida de {client_address}")
-            username = catch_username(message)
-            print(f"[CONEXÃO] Novo cliente conectado: {client_address} (usuário: {username})")
-            send_message(connected_message(), server_socket, client_address)
-            notify_every_client(clients, new_user_connection_message(username), server_socket)
-            clients[client_address] = username 
-        elif not is_client_in_room(client_address, clients) and not is_connect_command(message):
-            print(f"[ERRO] Cliente {client_address} tentou enviar mensagem sem estar conectado.")
-            send_message(not_connected_message(),server_socket, client_address)
-        elif is_exit_command(message):
-            disconnected_user = clients[client_address]
-            del clients[client_address]
-            print(f"[DESCONECTADO] Cliente desconectado: {client_address} (usuário: {disconnected_user})")
-            send_message(disconnected_message(), server_socket, client_address)
-            notify_every_client(clients, user_logged_out_message(disconnected_user),server_socket)
-        else:
-            formatted_message = format_message(message, client_address, clients)
-            print(f"[MENSAGEM] Mensagem recebida de {client_address}: {formatted_message}")
-            notify_every_client(clients, formatted_message, server_socket)
+        datagrams = [data]
+    for data in datagrams:
+        handle_datagram(data, client_address, server_socket)
+
+# Lê e aplica um evento do canal de controle
+def receive_control_event(server_socket):
+    try:
+        event = control.receive()
+    except ValueError as e:
+        logger.error("[ERRO] Evento de controle inválido: %s", e)
+        return
+    handle_control_event(event, server_socket)
+
+# Modo multiprocesso: workers processos ligados à mesma porta com SO_REUSEPORT, cada um com
+# sua engine bloqueante. O registro de clientes e os broadcasts são replicados entre eles
+# pelo canal de controle (cluster.Cluster).
+def start_workers(workers, ip=SERVER_IP, port=SERVER_PORT, batch_io=False):
+    control_sockets = cluster.create_control_sockets(workers)
+    addresses = [control_socket.getsockname() for control_socket in control_sockets]
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=run_worker, args=(index, control_sockets, addresses, ip, port, batch_io))
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+    for control_socket in control_sockets:
+        control_socket.close()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+# Processo worker: guarda apenas o seu socket de controle e inicia a engine bloqueante, com
+# a sua própria thread de log (a do processo pai não existe após o fork)
+def run_worker(index, control_sockets, addresses, ip, port, batch_io):
+    global control
+    listener = logs.setup(logger, logger.level)
+    for i, control_socket in enumerate(control_sockets):
+        if i != index:
+            control_socket.close()
+    control = cluster.Cluster(index, control_sockets[index], addresses)
+    logger.info("[INFO] Worker %d iniciado (PID %d)", index, multiprocessing.current_process().pid)
+    try:
+        start_server(ip, port, batch_io, reuse_port=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logs.stop(listener)
+
+# Engine asyncio: mesmo tratamento de datagramas, dirigido pelo event loop. A roda de
+# temporizadores é avançada por um único callback do loop, reagendado para o próximo prazo.
+class ChatServerProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        logger.info(server_start_message(transport.get_extra_info('socket')))
+        self.loop = asyncio.get_running_loop()
+        self.tick_handle = None
+        expire_reassembly()
+        write_metrics()
+        self.schedule_tick()
+
+    def datagram_received(self, data, client_address):
+        handle_datagram(data, client_address, self.transport)
+        self.schedule_tick()
+
+    def error_received(self, exc):
+        logger.error("[ERRO] Erro no socket: %s", exc)
+
+    def connection_lost(self, exc):
+        if self.tick_handle is not None:
+            self.tick_handle.cancel()
+
+    # Agenda o avanço da roda para o próximo prazo, se ele for antes do já agendado
+    def schedule_tick(self):
+        delay = scheduler.next_timeout()
+        if delay is None:
+            return
+        when = self.loop.time() + delay
+        if self.tick_handle is not None:
+            if self.tick_handle.when() <= when:
+                return
+            self.tick_handle.cancel()
+        self.tick_handle = self.loop.call_at(when, self.tick)
+
+    def tick(self):
+        self.tick_handle = None
+        scheduler.advance()
+        self.schedule_tick()
+
+async def serve(ip=SERVER_IP, port=SERVER_PORT):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(ChatServerProtocol, local_addr=(ip, port))
+    try:
+        await asyncio.Future()
+    finally:
+        transport.close()
+
+# Função principal do servidor (engine asyncio)
+def start_server_asyncio(ip=SERVER_IP, port=SERVER_PORT):
+    asyncio.run(serve(ip, port))
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Servidor do chat sobre UDP (RDT 3.0)")
+    parser.add_argument("--engine", choices=["blocking", "asyncio"], default="blocking",
+                        help="laço recvfrom bloqueante ou asyncio.DatagramProtocol")
+    parser.add_argument("--batch-io", action="store_true",
+                        help="envio e recepção em lote com UDP GSO/GRO (Linux, engine bloqueante)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="número de processos ligados à mesma porta com SO_REUSEPORT (engine bloqueante)")
+    parser.add_argument("--metrics-file",
+                        help="arquivo JSON em que o snapshot das métricas é gravado periodicamente")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL,
+                        help="intervalo, em segundos, da gravação do snapshot das métricas")
+    parser.add_argument("--coalesce-delay", type=float, default=COALESCE_DELAY,
+                        help="atraso máximo, em segundos, para agrupar mensagens curtas em um único datagrama por cliente (0 desativa)")
+    parser.add_argument("--log-level", choices=logs.LEVELS, default="INFO",
+                        help="nível mínimo das mensagens de log (DEBUG inclui uma linha por pacote)")
+    args = parser.parse_args()
+    logs.setup(logger, args.log_level)
+    metrics_file = args.metrics_file
+    metrics_interval = args.metrics_interval
+    coalesce_delay = args.coalesce_delay
+    if args.workers < 1:
+        parser.error("--workers deve ser pelo menos 1")
+    if args.workers > 1 and args.engine != "blocking":
+        parser.error("--workers só é suportado pela engine bloqueante")
+    try:
+        if args.workers > 1:
+            start_workers(args.workers, batch_io=args.batch_io)
+        elif args.engine == "asyncio":
+            start_server_asyncio()
+        else:
+            start_server(batch_io=args.batch_io)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,29 @@
+import pytest
+
+import codec
+
+LEGACY_ID = "0b5c9a1e-5f7e-4c1d-9a43-7d2f0e6b8c11"
+
+
+@pytest.mark.parametrize("version, msg_id", [(codec.PROTOCOL_VERSION, 7), (codec.LEGACY_VERSION, LEGACY_ID)])
+@pytest.mark.parametrize("seq, total", [(0, 0), (3, 3), (5, 2)])
+def test_data_packet_with_seq_outside_total_is_rejected(version, msg_id, seq, total):
+    data = codec.encode_data(msg_id, seq, total, b"x", version=version)
+    with pytest.raises(codec.PacketError) as error:
+        codec.decode(data)
+    assert not isinstance(error.value, codec.ChecksumError)
+    assert error.value.msg_id == msg_id
+
+
+@pytest.mark.parametrize("version, msg_id", [(codec.PROTOCOL_VERSION, 7), (codec.LEGACY_VERSION, LEGACY_ID)])
+def test_last_data_packet_is_accepted(version, msg_id):
+    packet = codec.decode(codec.encode_data(msg_id, 2, 3, b"x", codec.FLAG_END, version))
+    assert (packet.kind, packet.msg_id, packet.seq, packet.total) == (codec.DATA, msg_id, 2, 3)
+    assert bytes(packet.payload) == b"x"
+
+
+def test_sack_reuses_the_total_field_for_the_window():
+    # Nos SACKs, TOTAL_PACKETS é a janela anunciada: 0 é válido
+    packet = codec.decode(codec.encode_sack(7, 5, window=0))
+    assert codec.ack_info(packet) == (5, [])
+    assert codec.advertised_window(packet) == 0
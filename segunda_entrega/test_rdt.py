@@ -0,0 +1,197 @@
+import codec
+import config
+import rdt
+import transfer
+from Fragmentation import Fragmenter
+from timers import TimerWheel
+
+ADDRESS = ("127.0.0.1", 9)
+SENDER = ("127.0.0.1", 10)
+
+
+class FakeSocket:
+    """Socket que guarda os datagramas enviados em vez de enviá-los."""
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append(codec.decode(data))
+
+
+# Cria um PeerSender com a janela de congestionamento informada, sobre um socket falso
+def make_peer(cwnd=4):
+    sock = FakeSocket()
+    peer = rdt.PeerSender(ADDRESS, sock, TimerWheel())
+    peer.congestion.cwnd = cwnd
+    return peer, sock
+
+
+# Inicia `count` mensagens de `size` bytes. Retorna os IDs.
+def start_messages(peer, count, size=10):
+    fragmenter = Fragmenter()
+    ids = []
+    for msg_id in range(1, count + 1):
+        peer.start(msg_id, fragmenter.fragment(b"x" * size, msg_id))
+        ids.append(msg_id)
+    return ids
+
+
+def test_congestion_window_limits_fragments_in_flight_across_messages():
+    peer, sock = make_peer(cwnd=4)
+    start_messages(peer, 10)
+    assert len(sock.sent) == 4
+    assert peer.in_flight == 4
+    assert [packet.msg_id for packet in sock.sent] == [1, 2, 3, 4]
+
+
+def test_acks_let_stalled_messages_continue_in_order():
+    peer, sock = make_peer(cwnd=4)
+    start_messages(peer, 10)
+    peer.congestion.on_ack = lambda count, in_flight: None
+    assert peer.on_ack(1, 1, [])
+    assert peer.on_ack(2, 1, [])
+    assert [packet.msg_id for packet in sock.sent] == [1, 2, 3, 4, 5, 6]
+    assert peer.in_flight == 4
+    assert 1 not in peer.sends and 2 not in peer.sends
+
+
+def test_legacy_peer_sends_one_fragment_at_a_time_across_messages():
+    sock = FakeSocket()
+    peer = rdt.PeerSender(ADDRESS, sock, TimerWheel(), window_size=rdt.LEGACY_WINDOW_SIZE,
+                          max_in_flight=rdt.LEGACY_WINDOW_SIZE)
+    peer.congestion.cwnd = 16
+    fragmenter = Fragmenter(version=codec.LEGACY_VERSION)
+    size = fragmenter.payload_size * 2 + 1
+    for msg_id in ("1", "2"):
+        peer.start(msg_id, fragmenter.fragment(b"x" * size, msg_id))
+    assert [(packet.msg_id, packet.seq) for packet in sock.sent] == [("1", 0)]
+    # O fragmento se perde: a retransmissão sai antes de qualquer outro fragmento
+    peer.retransmit("1", 0)
+    assert [(packet.msg_id, packet.seq) for packet in sock.sent] == [("1", 0), ("1", 0)]
+    # Cada ACK individual do formato legado libera o fragmento seguinte, em ordem
+    for msg_id, seq in (("1", 0), ("1", 1), ("1", 2), ("2", 0)):
+        peer.on_ack(msg_id, 0, (seq,))
+        assert peer.in_flight == 1
+    assert [(packet.msg_id, packet.seq) for packet in sock.sent[2:]] == [("1", 1), ("1", 2), ("2", 0), ("2", 1)]
+
+
+def test_abandon_releases_fragments_in_flight():
+    peer, sock = make_peer(cwnd=4)
+    start_messages(peer, 3, size=3000)
+    assert peer.in_flight == 4
+    peer.abandon_all()
+    assert peer.in_flight == 0
+    assert not peer.sends and not peer.unsent
+    assert len(peer.scheduler) == 0
+
+
+class NullScheduler:
+    """Roda de temporizadores que ignora os ACKs atrasados (o teste usa ack_delay=0)."""
+
+    def arm(self, key, delay, callback):
+        pass
+
+    def cancel(self, key):
+        pass
+
+
+# Entrega ao receptor os pacotes do remetente (dados ou consultas) e devolve ao remetente os
+# SACKs da resposta. Retorna os SACKs.
+def round_trip(peer, receiver, packets):
+    replies = FakeSocket()
+    for packet in packets:
+        if packet.kind == codec.QUERY:
+            receiver.answer_query(replies, SENDER, packet.msg_id, config.DATAGRAM_SIZE)
+        else:
+            receiver.receive(packet, SENDER, replies)
+    for sack in replies.sent:
+        peer.on_ack(sack.msg_id, *codec.ack_info(sack), codec.advertised_window(sack))
+    return replies.sent
+
+
+def test_advertised_window_applies_to_new_messages_of_the_peer():
+    peer, sock = make_peer(cwnd=4)
+    backlog = [rdt.REASSEMBLY_MAX_BYTES]
+    receiver = rdt.SackReceiver(NullScheduler(), ack_delay=0, backlog=lambda: backlog[0])
+    start_messages(peer, 1)
+    # O SACK que conclui a mensagem 1 anuncia janela zero: as seguintes aguardam
+    [sack] = round_trip(peer, receiver, sock.sent)
+    assert codec.advertised_window(sack) == 0
+    peer.start(2, Fragmenter().fragment(b"y", 2))
+    peer.start(3, Fragmenter().fragment(b"z", 3))
+    assert len(sock.sent) == 1
+    assert (ADDRESS, "probe") in peer.scheduler
+    # A aplicação consome o que recebeu; a sonda pergunta pela mensagem 2, que o receptor
+    # ainda não conhece, e a resposta reabre a janela
+    backlog[0] = 0
+    peer.probe()
+    [answer] = round_trip(peer, receiver, sock.sent[1:])
+    assert answer.msg_id == 2
+    assert codec.ack_info(answer) == (0, [])
+    assert codec.advertised_window(answer) > 0
+    assert [(packet.kind, packet.msg_id) for packet in sock.sent[2:]] == [(codec.DATA, 2), (codec.DATA, 3)]
+    assert (ADDRESS, "probe") not in peer.scheduler
+
+
+def test_zero_window_probe_queries_the_oldest_waiting_message():
+    peer, sock = make_peer(cwnd=4)
+    peer.advertise(0)
+    start_messages(peer, 2)
+    peer.probe()
+    assert sock.sent[-1].kind == codec.QUERY
+    assert sock.sent[-1].msg_id == 1
+    assert peer.probes == 1
+
+
+def test_receive_window_is_split_between_senders():
+    receiver = rdt.SackReceiver(NullScheduler(), ack_delay=0)
+    payload = receiver.payload_size
+    receiver.reassembly.max_bytes = 10 * payload
+    fragmenter = Fragmenter()
+    a, b = ("10.0.0.1", 1), ("10.0.0.2", 2)
+    for packet in fragmenter.fragment(b"a" * 20 * payload, 1)[:3]:
+        receiver.receive(codec.decode(packet), a, FakeSocket())
+    assert receiver.receive_window(a) == 7
+    assert receiver.receive_window(b) == 5
+    receiver.receive(codec.decode(fragmenter.fragment(b"b" * 20 * payload, 2)[0]), b, FakeSocket())
+    # Cada um fica com metade do limite: juntos, não passam do espaço livre
+    assert receiver.receive_window(a) == 2
+    assert receiver.receive_window(b) == 4
+
+
+def test_transfer_only_accepts_fragments_from_the_announcing_peer(tmp_path):
+    receiver = rdt.SackReceiver(NullScheduler(), ack_delay=0)
+    payload = receiver.payload_size
+    owner, other = ("10.0.0.1", 1), ("10.0.0.2", 2)
+    file_transfer = transfer.FileTransfer(str(tmp_path), 7, "f.bin", 2 * payload, payload)
+    receiver.transfers[(owner, 7)] = file_transfer
+    packets = [codec.decode(packet) for packet in Fragmenter().fragment(b"a" * 2 * payload, 7)]
+    # O mesmo ID vindo de outro endereço é uma mensagem comum, e a consulta não revela a
+    # transferência
+    replies = FakeSocket()
+    receiver.receive(packets[0], other, replies)
+    receiver.answer_query(replies, other, 7, config.DATAGRAM_SIZE)
+    assert file_transfer.count == 0
+    assert [codec.ack_info(sack)[0] for sack in replies.sent] == [1, 1]
+    receiver.receive(packets[0], owner, replies)
+    assert file_transfer.count == 1
+    file_transfer.close()
+
+
+def test_delivered_hits_count_only_duplicates_of_delivered_messages():
+    receiver = rdt.SackReceiver(NullScheduler(), ack_delay=0)
+    replies = FakeSocket()
+    fragmenter = Fragmenter()
+    for msg_id in range(1, 6):
+        for packet in fragmenter.fragment(b"x" * 2000, msg_id):
+            receiver.receive(codec.decode(packet), SENDER, replies)
+    assert receiver.stats.counters["messages_in"] == 5
+    assert receiver.stats.counters["delivered_hits"] == 0
+    # Cada fragmento retransmitido de uma mensagem entregue é um acerto, reconfirmado com SACK
+    duplicate = codec.decode(fragmenter.fragment(b"x" * 2000, 3)[1])
+    for count in (1, 2):
+        receiver.receive(duplicate, SENDER, replies)
+        assert receiver.stats.counters["delivered_hits"] == count
+    assert codec.ack_info(replies.sent[-1])[0] == 2
+    assert receiver.stats.counters["delivered_misses"] == 0
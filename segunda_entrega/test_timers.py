@@ -0,0 +1,175 @@
+from functools import partial
+
+from timers import TimerWheel
+
+# Roda pequena e tick exato em binário (0,5 s), para que os prazos caiam sempre no mesmo tick:
+# uma volta da roda dura SLOTS * TICK = 4 s
+TICK = 0.5
+SLOTS = 8
+
+
+class FakeClock:
+    """Relógio controlado pelo teste, injetado na TimerWheel no lugar de time.monotonic."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# Cria uma roda com relógio falso e a lista em que os callbacks registram suas chaves
+def make_wheel():
+    clock = FakeClock()
+    return TimerWheel(TICK, SLOTS, clock), clock, []
+
+
+def test_timers_due_in_the_same_advance_fire_in_deadline_order():
+    wheel, clock, fired = make_wheel()
+    wheel.arm("c", 3.0, partial(fired.append, "c"))
+    wheel.arm("a", 1.0, partial(fired.append, "a"))
+    wheel.arm("b", 2.0, partial(fired.append, "b"))
+    # Dois prazos no mesmo tick também saem na ordem do prazo
+    wheel.arm("d", 2.4, partial(fired.append, "d"))
+    wheel.arm("e", 2.2, partial(fired.append, "e"))
+    clock.now = 3.0
+    assert wheel.advance() == 5
+    assert fired == ["a", "b", "e", "d", "c"]
+    assert len(wheel) == 0
+
+
+def test_timer_does_not_fire_before_its_deadline():
+    wheel, clock, fired = make_wheel()
+    wheel.arm("a", 1.5, partial(fired.append, "a"))
+    clock.now = 1.0
+    assert wheel.advance() == 0
+    assert "a" in wheel
+    assert wheel.next_timeout() == 0.5
+    clock.now = 1.5
+    assert wheel.advance() == 1
+    assert fired == ["a"]
+    assert "a" not in wheel
+    assert wheel.next_timeout() is None
+
+
+def test_cancel_removes_the_timer():
+    wheel, clock, fired = make_wheel()
+    wheel.arm("a", 1.0, partial(fired.append, "a"))
+    wheel.arm("b", 1.0, partial(fired.append, "b"))
+    assert wheel.cancel("a")
+    assert not wheel.cancel("a")
+    assert not wheel.cancel("desconhecido")
+    clock.now = 2.0
+    wheel.advance()
+    assert fired == ["b"]
+
+
+def test_rearm_replaces_the_previous_deadline_and_callback():
+    wheel, clock, fired = make_wheel()
+    wheel.arm("a", 1.0, partial(fired.append, "primeiro"))
+    wheel.arm("a", 3.0, partial(fired.append, "segundo"))
+    assert len(wheel) == 1
+    clock.now = 2.0
+    assert wheel.advance() == 0
+    clock.now = 3.0
+    assert wheel.advance() == 1
+    assert fired == ["segundo"]
+
+
+def test_callback_can_rearm_its_own_key():
+    wheel, clock, fired = make_wheel()
+
+    def tick():
+        fired.append(clock.now)
+        if len(fired) < 3:
+            wheel.arm("periodico", 1.0, tick)
+
+    wheel.arm("periodico", 1.0, tick)
+    for now in (1.0, 2.0, 3.0, 4.0):
+        clock.now = now
+        wheel.advance()
+    assert fired == [1.0, 2.0, 3.0]
+    assert "periodico" not in wheel
+
+
+def test_deadlines_more_than_one_revolution_away():
+    wheel, clock, fired = make_wheel()
+    # 10 s são duas voltas e meia da roda; "perto" cai na mesma posição da roda, uma volta antes
+    wheel.arm("longe", 10.0, partial(fired.append, "longe"))
+    wheel.arm("perto", 6.0, partial(fired.append, "perto"))
+    for now in (2.0, 4.0, 6.0, 8.0, 9.5):
+        clock.now = now
+        wheel.advance()
+    assert fired == ["perto"]
+    assert wheel.next_timeout() == 0.5
+    clock.now = 10.0
+    assert wheel.advance() == 1
+    assert fired == ["perto", "longe"]
+
+
+def test_late_advance_fires_everything_due_once_in_order():
+    wheel, clock, fired = make_wheel()
+    for key, delay in (("c", 9.0), ("a", 0.5), ("d", 13.0), ("b", 3.5)):
+        wheel.arm(key, delay, partial(fired.append, key))
+    wheel.arm("depois", 30.0, partial(fired.append, "depois"))
+    # Um único advance() atrasado em mais de três voltas da roda
+    clock.now = 14.0
+    assert wheel.advance() == 4
+    assert fired == ["a", "b", "c", "d"]
+    assert "depois" in wheel
+    clock.now = 30.0
+    assert wheel.advance() == 1
+    assert fired[-1] == "depois"
+
+
+def test_irregular_advances_do_not_accumulate_drift():
+    wheel, clock, fired = make_wheel()
+    wheel.arm("a", 1.0, lambda: fired.append(("a", clock.now)))
+    wheel.arm("b", 3.0, lambda: fired.append(("b", clock.now)))
+    # "a" é atendido com atraso; o prazo absoluto de "b" não muda por isso
+    for now in (0.2, 0.7, 2.7, 2.9, 3.0, 3.2):
+        clock.now = now
+        wheel.advance()
+    assert fired == [("a", 2.7), ("b", 3.0)]
+
+
+def test_advance_without_elapsed_ticks_is_a_no_op():
+    wheel, clock, fired = make_wheel()
+    wheel.arm("a", 0.5, partial(fired.append, "a"))
+    assert wheel.advance() == 0
+    clock.now = 0.4
+    assert wheel.advance() == 0
+    assert fired == []
+
+
+def test_next_timeout_follows_cancel_and_advance():
+    wheel, clock, fired = make_wheel()
+    wheel.arm("a", 1.0, partial(fired.append, "a"))
+    wheel.arm("b", 2.0, partial(fired.append, "b"))
+    wheel.arm("c", 9.0, partial(fired.append, "c"))
+    assert wheel.next_timeout() == 1.0
+    wheel.cancel("a")
+    assert wheel.next_timeout() == 2.0
+    clock.now = 2.0
+    wheel.advance()
+    # "c" está mais de uma volta à frente
+    assert wheel.next_timeout() == 7.0
+    wheel.cancel("c")
+    assert wheel.next_timeout() is None
+
+
+def test_next_timeout_does_not_scan_the_wheel():
+    wheel, clock, fired = make_wheel()
+    for key in range(10000):
+        wheel.arm(key, 1.0 + key % 40, partial(fired.append, key))
+    # Rearmar a mesma chave no mesmo tick não acumula entradas no heap
+    for _ in range(1000):
+        wheel.arm("vivo", 0.5, partial(fired.append, "vivo"))
+    assert len(wheel.ticks) == 41
+    # next_timeout() só consulta o heap dos ticks ocupados, nunca as posições da roda
+    slots, wheel.slots = wheel.slots, None
+    assert wheel.next_timeout() == 0.5
+    wheel.slots = slots
+    wheel.cancel("vivo")
+    wheel.slots = None
+    assert wheel.next_timeout() == 1.0
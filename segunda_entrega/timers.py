@@ -0,0 +1,97 @@
+import heapq
+import math
+import time
+
+# Resolução padrão da roda de temporizadores, em segundos
+TICK = 0.01
+# Número padrão de posições da roda (512 × 10 ms ≈ 5 s por volta)
+SLOTS = 512
+
+
+class TimerWheel:
+    """
+    Roda de temporizadores (hashed timing wheel) para os prazos de retransmissão.
+    Cada temporizador tem uma chave, por exemplo (endereço, ID, SEQ): arm() e cancel() custam
+    O(1), e advance() só visita as posições da roda correspondentes aos ticks decorridos, de
+    modo que dezenas de milhares de fragmentos sem ACK são acompanhados por uma única thread
+    ou event loop.
+    Os prazos são guardados em tempo absoluto (ticks desde a origem do relógio), portanto não
+    acumulam atraso quando advance() é chamado com irregularidade; temporizadores que vencem
+    no mesmo advance() disparam em ordem de prazo.
+    Um heap dos ticks ocupados mantém o próximo prazo: next_timeout(), chamado a cada volta do
+    laço de recepção, custa O(log n) amortizado em vez de percorrer a roda.
+    """
+
+    def __init__(self, tick=TICK, slots=SLOTS, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.slots = [{} for _ in range(slots)]
+        # Tick de vencimento de cada temporizador armado: {chave: tick}
+        self.timers = {}
+        # Ticks futuros que já receberam temporizadores, em heap, e quantos cada um tem armados
+        # ({tick: quantidade}; ticks esvaziados por cancel() saem do heap em next_timeout())
+        self.ticks = []
+        self.counts = {}
+        # Último tick já processado
+        self.current = math.floor(clock() / tick)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    # Arma (ou rearma) o temporizador da chave para disparar callback() após delay segundos
+    def arm(self, key, delay, callback):
+        self.cancel(key)
+        deadline = self.clock() + delay
+        expires = max(math.ceil(deadline / self.tick), self.current + 1)
+        self.slots[expires % len(self.slots)][key] = (expires, deadline, callback)
+        self.timers[key] = expires
+        if expires not in self.counts:
+            self.counts[expires] = 0
+            heapq.heappush(self.ticks, expires)
+        self.counts[expires] += 1
+
+    # Cancela o temporizador da chave. Retorna False se ele não estava armado.
+    def cancel(self, key):
+        expires = self.timers.pop(key, None)
+        if expires is None:
+            return False
+        del self.slots[expires % len(self.slots)][key]
+        self.counts[expires] -= 1
+        return True
+
+    # Dispara os temporizadores vencidos até o instante atual. Retorna quantos dispararam.
+    def advance(self):
+        target = math.floor(self.clock() / self.tick)
+        if target <= self.current:
+            return 0
+        # Se passou mais de uma volta, cada posição é visitada uma única vez
+        first = max(self.current + 1, target - len(self.slots) + 1)
+        due = []
+        for tick in range(first, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            for key, entry in list(slot.items()):
+                if entry[0] <= target:
+                    del slot[key]
+                    del self.timers[key]
+                    due.append(entry)
+        self.current = target
+        while self.ticks and self.ticks[0] <= target:
+            del self.counts[heapq.heappop(self.ticks)]
+        due.sort(key=lambda entry: entry[1])
+        for _, _, callback in due:
+            callback()
+        return len(due)
+
+    # Tempo, em segundos, até o próximo tick com temporizadores a disparar,
+    # ou None se não há temporizadores armados
+    def next_timeout(self):
+        if not self.timers:
+            return None
+        while not self.counts[self.ticks[0]]:
+            del self.counts[heapq.heappop(self.ticks)]
+        return max(0.0, self.ticks[0] * self.tick - self.clock())
@@ -0,0 +1,163 @@
+import hashlib
+import math
+import os
+
+import codec
+
+# Diretório onde o servidor guarda os arquivos recebidos e o estado das transferências
+RECEIVED_FILES_DIR = "arquivos_recebidos"
+# Tamanho máximo de um arquivo aceito pelo receptor
+MAX_FILE_SIZE = 4 * 1024 * 1024 * 1024
+# Número máximo de fragmentos de um arquivo aceito pelo receptor (bitmap de até 2 MiB)
+MAX_FRAGMENTS = 16 * 1024 * 1024
+# O bitmap de fragmentos recebidos é gravado em disco a cada PERSIST_EVERY fragmentos novos
+PERSIST_EVERY = 256
+
+# Comando de anúncio de uma transferência, enviado como mensagem de chat antes dos fragmentos:
+#   /arquivo <ID em hexadecimal> <tamanho> <payload por fragmento> <nome>
+ANNOUNCE_COMMAND = "/arquivo "
+
+
+# Identificador de transferência de um arquivo: derivado do nome, do tamanho e da data de
+# modificação, de modo que reenviar o mesmo arquivo retoma a mesma transferência
+def transfer_id(path):
+    stat = os.stat(path)
+    key = f"{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8')
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], 'big')
+
+
+# Monta o comando de anúncio de uma transferência
+def announce_message(transfer, name, size, payload_size):
+    return f"{ANNOUNCE_COMMAND}{transfer:x} {size} {payload_size} {name}"
+
+
+# Verifica se a mensagem é um anúncio de transferência
+def is_announce(message):
+    return message.startswith(ANNOUNCE_COMMAND)
+
+
+# Lê um anúncio de transferência. O payload por fragmento precisa ser o do receptor
+# (payload_size), e o arquivo, caber em MAX_FILE_SIZE bytes e MAX_FRAGMENTS fragmentos.
+# Retorna (ID, tamanho, payload por fragmento, nome) ou lança ValueError se o comando for
+# inválido.
+def parse_announce(message, payload_size):
+    fields = message[len(ANNOUNCE_COMMAND):].split(" ", 3)
+    if len(fields) != 4:
+        raise ValueError("anúncio de arquivo incompleto")
+    transfer, size, announced = int(fields[0], 16), int(fields[1]), int(fields[2])
+    name = os.path.basename(fields[3].strip())
+    if name in ("", ".", "..") or not 0 <= size <= MAX_FILE_SIZE:
+        raise ValueError("anúncio de arquivo inválido")
+    if announced != payload_size:
+        raise ValueError(f"payload de {announced} bytes por fragmento, o receptor usa {payload_size}")
+    if math.ceil(size / payload_size) > MAX_FRAGMENTS:
+        raise ValueError(f"arquivo com mais de {MAX_FRAGMENTS} fragmentos")
+    return transfer, size, payload_size, name
+
+
+class FileTransfer:
+    """
+    Recepção retomável de um arquivo. Cada fragmento é gravado diretamente na sua posição
+    (SEQ × payload) em um arquivo parcial, e um bitmap dos fragmentos recebidos é mantido em
+    disco ao lado dele, indexado pelo ID da transferência. Se a transferência for
+    interrompida (queda do remetente ou do receptor), um novo anúncio com o mesmo ID reabre
+    o estado salvo, e o remetente só precisa reenviar os fragmentos que faltam.
+    Oferece a mesma interface de estado de um ReassemblyBuffer (cumulative, sack_bitmap,
+    complete), usada pelo SackReceiver para confirmar os fragmentos com SACK.
+    """
+
+    def __init__(self, directory, transfer, name, size, payload_size):
+        self.transfer = transfer
+        self.name = name
+        self.size = size
+        self.payload_size = payload_size
+        self.total = math.ceil(size / payload_size)
+        self.directory = directory
+        self.part_path = os.path.join(directory, f"{transfer:016x}.part")
+        self.state_path = os.path.join(directory, f"{transfer:016x}.bitmap")
+        self.updated = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+        # Bitmap dos fragmentos recebidos (bit seq % 8 do byte seq // 8), retomado do disco
+        self.received = bytearray((self.total + 7) // 8)
+        if os.path.exists(self.state_path) and os.path.exists(self.part_path):
+            with open(self.state_path, 'rb') as state:
+                saved = state.read()
+            if len(saved) == len(self.received):
+                self.received[:] = saved
+        self.count = int.from_bytes(self.received, 'little').bit_count()
+        self.unsaved = 0
+        # ACK cumulativo: todos os fragmentos abaixo deste SEQ já chegaram
+        self.cumulative = 0
+        self._advance()
+
+        mode = 'r+b' if os.path.exists(self.part_path) else 'w+b'
+        self.file = open(self.part_path, mode)
+        self.file.truncate(size)
+
+    def __contains__(self, seq):
+        return 0 <= seq < self.total and bool(self.received[seq // 8] & (1 << (seq % 8)))
+
+    # Grava o fragmento na sua posição do arquivo. Retorna False se for duplicado, estiver fora
+    # do intervalo ou tiver tamanho diferente do esperado.
+    def add(self, seq, payload):
+        if not 0 <= seq < self.total or seq in self:
+            return False
+        expected = self.payload_size if seq < self.total - 1 else self.size - seq * self.payload_size
+        if len(payload) != expected:
+            return False
+        self.file.seek(seq * self.payload_size)
+        self.file.write(payload)
+        self.received[seq // 8] |= 1 << (seq % 8)
+        self.count += 1
+        self._advance()
+        self.unsaved += 1
+        if self.unsaved >= PERSIST_EVERY:
+            self.save()
+        return True
+
+    def complete(self):
+        return self.count == self.total
+
+    # Números de sequência recebidos acima do ACK cumulativo, até limit fragmentos adiante
+    def received_above(self, limit):
+        last = min(self.cumulative + 1 + limit, self.total)
+        return [seq for seq in range(self.cumulative + 1, last) if seq in self]
+
+    # Bitmap SACK dos fragmentos recebidos fora de ordem, acima do ACK cumulativo
+    def sack_bitmap(self, limit):
+        return codec.sack_bitmap(self.cumulative, self.received_above(limit))
+
+    # Grava em disco os dados e o bitmap dos fragmentos recebidos
+    def save(self):
+        self.file.flush()
+        temporary = self.state_path + ".tmp"
+        with open(temporary, 'wb') as state:
+            state.write(self.received)
+        os.replace(temporary, self.state_path)
+        self.unsaved = 0
+
+    # Fecha o arquivo parcial, salvando o estado para uma retomada posterior
+    def close(self):
+        if not self.file.closed:
+            self.save()
+            self.file.close()
+
+    # Conclui a transferência: move o arquivo para o nome final (sem sobrescrever arquivos
+    # existentes) e apaga o estado. Retorna o caminho final.
+    def finish(self):
+        self.file.close()
+        base, extension = os.path.splitext(self.name)
+        final_path = os.path.join(self.directory, self.name)
+        copy = 1
+        while os.path.exists(final_path):
+            final_path = os.path.join(self.directory, f"{base} ({copy}){extension}")
+            copy += 1
+        os.replace(self.part_path, final_path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return final_path
+
+    def _advance(self):
+        while self.cumulative < self.total and self.cumulative in self:
+            self.cumulative += 1